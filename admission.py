@@ -0,0 +1,65 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f'OCR capacity exhausted ({reason})')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """Caps concurrent OCR at `slots`; at most `max_waiting` callers queue for up to `max_wait` seconds."""
+
+    def __init__(self, slots, max_waiting, max_wait):
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+
+    @contextmanager
+    def admit(self, block=False):
+        # block=True is for callers that are already bounded elsewhere (the job workers,
+        # a batch's in-flight window): they wait as long as it takes and do not count
+        # against the wait queue.
+        waited = self.acquire(block)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def acquire(self, block=False):
+        # For slots held across threads (a batch page running in a worker process);
+        # returns the seconds waited and must be paired with release()
+        start = time.perf_counter()
+        if not self._semaphore.acquire(blocking=False):
+            if block:
+                self._semaphore.acquire()
+            else:
+                with self._lock:
+                    if self.waiting >= self.max_waiting:
+                        raise Overloaded('queue_full', self.retry_after())
+                    self.waiting += 1
+                try:
+                    acquired = self._semaphore.acquire(timeout=self.max_wait)
+                finally:
+                    with self._lock:
+                        self.waiting -= 1
+                if not acquired:
+                    raise Overloaded('timeout', self.retry_after())
+        with self._lock:
+            self.active += 1
+        return time.perf_counter() - start
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._semaphore.release()
+
+    def retry_after(self):
+        return max(1, int(round(self.max_wait)))
@@ -1,86 +1,422 @@
-from flask import Flask, request, jsonify, render_template_string
+import startup
+from flask import Flask, g, request, jsonify, redirect, render_template, url_for
 import os
+import csv
+import hashlib
+import hmac
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
 import tempfile
-import base64
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
 from werkzeug.utils import secure_filename
+from admission import AdmissionLimiter, Overloaded
+from buffers import BufferPool
+from jobs import JobQueue, QueueFull
+from metrics import SIZE_BUCKETS, Registry
+from parsing import MARK_CHARACTERS, SUBJECT_KEYWORDS, apply_reread, parse_ocr_data, reread_candidates
+from result_cache import BlobCache, ResultCache, make_key
+from result_store import COLUMNS as RECORD_COLUMNS, ResultStore
+from uploads import HEADER_BYTES, MAX_PIXELS, SpoolingRequest, inspect_header, upload_buffer
 
-try:
-    import pytesseract
-    import cv2
-    import pandas as pd
-    from pytesseract import Output
-    OCR_AVAILABLE = True
-except ImportError:
-    OCR_AVAILABLE = False
+# The OCR stack takes most of a cold start (pytesseract alone pulls in pandas), so it is
+# imported on first use or by the warm-up thread, never for the upload form or /healthz
+cv2 = startup.LazyModule('cv2')
+layout_templates = startup.LazyModule('layout_templates')
+ocr_engine = startup.LazyModule('ocr_engine')
+pdf_pages = startup.LazyModule('pdf_pages')
+preprocess = startup.LazyModule('preprocess')
+OCR_AVAILABLE = all(importlib.util.find_spec(name) for name in ('cv2', 'numpy', 'pytesseract'))
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-UPLOAD_FOLDER = tempfile.gettempdir()
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.request_class = SpoolingRequest
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_BYTES', 64 * 1024 * 1024))
+app.config['PER_FILE_UPLOAD_ENDPOINTS'] = {'batch'}
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['BATCH_WINDOW'] = int(os.environ.get('BATCH_WINDOW', 2 * app.config['BATCH_WORKERS']))
+app.config['BATCH_MAX_UNZIPPED_BYTES'] = int(os.environ.get('BATCH_MAX_UNZIPPED_BYTES',
+                                                            4 * app.config['MAX_CONTENT_LENGTH']))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+app.config['JOB_QUEUE_DEPTH'] = int(os.environ.get('JOB_QUEUE_DEPTH', 32))
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 600))
+app.config['JOB_MAX_WAIT'] = 30
+app.config['THUMBNAIL_SIZE'] = int(os.environ.get('THUMBNAIL_SIZE', 480))
+app.config['OCR_SLOTS'] = int(os.environ.get('OCR_SLOTS', os.cpu_count() or 1))
+app.config['OCR_MAX_WAITING'] = int(os.environ.get('OCR_MAX_WAITING', 2 * app.config['OCR_SLOTS']))
+app.config['OCR_MAX_WAIT'] = float(os.environ.get('OCR_MAX_WAIT', 5))
+
+LAYOUT_TEMPLATE_DIR = os.environ.get('LAYOUT_TEMPLATE_DIR') if OCR_AVAILABLE else None
+_template_library = None
+_template_library_lock = threading.Lock()
+
+def get_template_library():
+    # Loaded on first use: matching needs OpenCV, which the web process defers
+    global _template_library
+    if not LAYOUT_TEMPLATE_DIR:
+        return None
+    with _template_library_lock:
+        if _template_library is None:
+            _template_library = layout_templates.TemplateLibrary(
+                LAYOUT_TEMPLATE_DIR,
+                min_inliers=int(os.environ.get('LAYOUT_MIN_INLIERS', 40))
+            )
+        return _template_library
+
+def template_fingerprint(directory):
+    # Changes whenever a template is added, removed or relearned, so cached results are
+    # dropped; from file stats, so computing it loads no templates
+    if not directory or not os.path.isdir(directory):
+        return None
+    digest = hashlib.sha256()
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            digest.update(f'{entry.name}:{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def load_profile(path, choice=None):
+    # Settings of one config from a `python -m benchmarks.autotune` profile; the profile's
+    # default unless OCR_PROFILE_CONFIG names another of its Pareto configs
+    if not path:
+        return {}
+    with open(path) as f:
+        profile = json.load(f)
+    choice = choice or profile['default']
+    for config in profile['configs']:
+        if config['name'] == choice:
+            logger.info('OCR profile %s: using %s', path, choice)
+            return config['settings']
+    raise ValueError(f'OCR profile {path} has no config named {choice!r}')
+
+_profile = load_profile(os.environ.get('OCR_PROFILE'), os.environ.get('OCR_PROFILE_CONFIG'))
 
-DIGIT_WORD_MAP = {
-    'ZERO': '0', 'ONE': '1', 'TWO': '2', 'THREE': '3', 'FOUR': '4',
-    'FIVE': '5', 'SIX': '6', 'SEVEN': '7', 'EIGHT': '8', 'NINE': '9'
+def setting(variable, key, default, cast=str):
+    # An explicit OCR_* variable wins over the profile, which wins over the built-in default
+    if variable in os.environ:
+        return cast(os.environ[variable])
+    return _profile.get(key, default)
+
+def flag(value):
+    return value != '0'
+
+# Anything that changes extraction output belongs here so cached results are invalidated
+PIPELINE_CONFIG = {
+    'version': 9,
+    'lang': os.environ.get('OCR_LANG', 'eng'),
+    'threshold': setting('OCR_THRESHOLD', 'threshold', 'otsu'),
+    'psm': setting('OCR_PSM', 'psm', None, int),
+    'text_regions': setting('OCR_TEXT_REGIONS', 'text_regions', True, flag),
+    'text_height': setting('OCR_TEXT_HEIGHT', 'text_height', 30, int),
+    'min_decode_long_side': int(os.environ.get('OCR_MIN_DECODE_LONG_SIDE', 2000)),
+    'subject_keywords': SUBJECT_KEYWORDS,
+    'two_pass': setting('OCR_TWO_PASS', 'two_pass', True, flag),
+    'triage': setting('OCR_TRIAGE', 'triage', True, flag),
+    # A page outside any of these limits takes the heavy preprocessing chain
+    'quality_limits': {'min_contrast': 100, 'max_lighting': 20, 'min_sharpness': 300.0,
+                       'max_noise': 3.0, 'max_skew': 0.5},
+    'reread_conf': float(os.environ.get('OCR_REREAD_CONF', 60)),
+    'max_rereads': int(os.environ.get('OCR_MAX_REREADS', 12)),
+    'layout_templates': template_fingerprint(LAYOUT_TEMPLATE_DIR),
+    'tile_pixels': int(os.environ.get('OCR_TILE_PIXELS', 16_000_000)),
+    'tile_bytes': int(os.environ.get('OCR_TILE_MEMORY_MB', 8)) * 1024 * 1024,
 }
-KNOWN_SUBJECT_KEYWORDS = [
-    'ENGLISH', 'DZONGKHA', 'HISTORY', 'CIVICS', 'GEOGRAPHY',
-    'MATHS', 'SCIENCE', 'COMPUTER', 'APPLICATIONS', 'PHYSICS', 'CHEMISTRY', 'MATHEMATICS'
-]
-
-def words_to_number(words):
-    num_str = ''.join(DIGIT_WORD_MAP.get(w.upper(), '') for w in words if w.upper() in DIGIT_WORD_MAP)
-    return int(num_str) if num_str.isdigit() else None
-
-def merge_subject_keywords(line_words):
-    full_line = ' '.join(line_words).upper()
-    subjects = [kw for kw in KNOWN_SUBJECT_KEYWORDS if kw in full_line]
-    return ' '.join(sorted(set(subjects))) if subjects else None
-
-def extract_digit_word_marks(words):
-    digit_words = [w.upper() for w in words if w.upper() in DIGIT_WORD_MAP]
-    if len(digit_words) >= 2:
-        return words_to_number(digit_words[:3])
-    return None
 
-def extract_data_from_image(image_path):
-    image = cv2.imread(image_path)
+# Scratch arrays for grayscale, resized and thresholded pages, one set kept per OCR slot
+buffer_pool = BufferPool(int(os.environ.get('OCR_BUFFER_POOL_MB', 64)) * 1024 * 1024,
+                         max_sets=app.config['OCR_SLOTS'])
+
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 256)),
+    disk_dir=os.environ.get('RESULT_CACHE_DIR') or None
+)
+
+ocr_limiter = AdmissionLimiter(
+    app.config['OCR_SLOTS'],
+    max_waiting=app.config['OCR_MAX_WAITING'],
+    max_wait=app.config['OCR_MAX_WAIT']
+)
+
+# Results are only persisted when RESULT_DB names a SQLite file; it is opened on first use
+RESULT_DB = os.environ.get('RESULT_DB') or None
+# The /records routes serve every stored result, so they need this bearer token; unset, they are off
+RECORDS_TOKEN = os.environ.get('RECORDS_TOKEN') or None
+_result_store = None
+_result_store_lock = threading.Lock()
+thumbnail_cache = BlobCache(max_entries=256, ttl=app.config['JOB_TTL'])
+
+_upload_page = None
+
+metrics_registry = Registry()
+STAGE_SECONDS = metrics_registry.histogram(
+    'ocr_stage_seconds', 'Time spent in each extraction and page-building stage', ['stage'])
+REQUEST_SECONDS = metrics_registry.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint', ['endpoint'])
+REQUESTS = metrics_registry.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status', ['endpoint', 'method', 'status'])
+EXTRACTIONS = metrics_registry.counter(
+    'extractions_total', 'Extraction results by outcome', ['outcome'])
+UPLOAD_BYTES = metrics_registry.histogram(
+    'upload_size_bytes', 'Size of images submitted for extraction', buckets=SIZE_BUCKETS)
+PREPROCESS_ROUTES = metrics_registry.counter(
+    'preprocess_route_total', 'Pages by preprocessing chain after quality triage', ['route'])
+SUBJECTS_EXTRACTED = metrics_registry.counter(
+    'subjects_extracted_total', 'Subjects extracted across all results')
+UPLOADS_REJECTED = metrics_registry.counter(
+    'uploads_rejected_total', 'Uploads refused while streaming in, by reason', ['reason'])
+ADMISSION_WAIT_SECONDS = metrics_registry.histogram(
+    'ocr_admission_wait_seconds', 'Time spent waiting for an OCR slot, separate from OCR time')
+ADMISSION_REJECTED = metrics_registry.counter(
+    'ocr_admission_rejected_total', 'Extractions turned away because OCR capacity was exhausted', ['reason'])
+metrics_registry.gauge(
+    'ocr_admission_slots', 'OCR slots in use and callers waiting for one',
+    lambda: {'active': ocr_limiter.active, 'waiting': ocr_limiter.waiting}, ['state'])
+metrics_registry.gauge(
+    'result_store_pending_writes', 'Records queued for the next SQLite batch',
+    lambda: {(): _result_store.pending() if _result_store else 0})
+metrics_registry.gauge(
+    'ocr_buffer_pool_bytes', 'Scratch page buffers held, in free sets and in sets leased by extractions',
+    lambda: buffer_pool.held_bytes(), ['state'])
+metrics_registry.gauge(
+    'startup_seconds', 'Cold-start time by step: eager app import, deferred imports, warm-up',
+    lambda: dict(startup.STEPS), ['step'])
+metrics_registry.callback_counter(
+    'result_cache_events_total', 'Result cache events (hits, misses, evictions, ...)',
+    lambda: dict(result_cache.counters), ['event'])
+
+BATCH_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+
+@contextmanager
+def timed(stats, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if stats is not None:
+            stats.setdefault('timings', {})[stage] = seconds
+
+def record_extraction(data, image_size, cached):
+    if image_size is not None:
+        UPLOAD_BYTES.observe(image_size)
+    if 'error' in data:
+        EXTRACTIONS.inc(outcome='error')
+    else:
+        EXTRACTIONS.inc(outcome='cached' if cached else 'extracted')
+        SUBJECTS_EXTRACTED.inc(len(data.get('subjects', [])))
+
+def extract_data_from_image(image, stats=None):
+    if isinstance(image, str):
+        image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
     if image is None:
         return {'error': 'Could not read image file'}
+    with buffer_pool.lease():
+        return extract_page(image, stats)
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    data = pytesseract.image_to_data(thresh, output_type=Output.DATAFRAME)
-    data = data[(data.conf > 0) & (data.text.str.strip() != '')].reset_index(drop=True)
-    lines = data.groupby('line_num')
-
-    extracted_subjects = []
-    name = None
-
-    name_line = data[data['text'].str.contains('Name', case=False, na=False)]
-    if not name_line.empty:
-        idx = name_line.index[0]
-        parts = data.loc[idx+1:idx+4, 'text'].tolist()
-        name = ' '.join([w.title() for w in parts if w.isalpha()])
-
-    for line_num, group in lines:
-        words = group.sort_values('left')['text'].tolist()
-        subject = merge_subject_keywords(words)
-        if not subject:
-            continue
-        all_words = list(words)
-        if (line_num + 1) in lines.groups:
-            all_words += data[data['line_num'] == (line_num + 1)]['text'].tolist()
-        word_based_mark = extract_digit_word_marks(all_words)
-        digit_marks = [int(w) for w in all_words if w.isdigit() and 30 <= int(w) <= 100]
-        mark = word_based_mark or (digit_marks[0] if digit_marks else None)
-        if mark:
-            subject_name = ' '.join(sorted(set(subject.title().split())))
-            if not any(s['subject'] == subject_name for s in extracted_subjects):
-                extracted_subjects.append({"subject": subject_name, "marks": mark})
-
-    return clean_result_data({
-        'name': name,
-        'subjects': extracted_subjects
-    })
+def extract_page(image, stats=None):
+    with timed(stats, 'normalize'):
+        gray = image
+        if image.ndim == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=buffer_pool.get('gray', image.shape[:2]))
+        gray = preprocess.normalize_resolution(gray, PIPELINE_CONFIG['text_height'], stats=stats,
+                                               buffers=buffer_pool)
+    if gray.size > PIPELINE_CONFIG['tile_pixels']:
+        return extract_tiled(gray, stats)
+
+    method = PIPELINE_CONFIG['threshold']
+    if PIPELINE_CONFIG['triage']:
+        gray, method = triage_page(gray, stats)
+    library = get_template_library()
+    raw_result, thresh = extract_with_template(gray, library, method, stats) if library else (None, None)
+    if raw_result is None:
+        with timed(stats, 'threshold'):
+            thresh = preprocess.binarize(gray, method, dst=buffer_pool.get('binary', gray.shape))
+        with timed(stats, 'regions'):
+            regions = preprocess.find_text_regions(thresh) if PIPELINE_CONFIG['text_regions'] else None
+        with timed(stats, 'ocr'):
+            if regions:
+                ocr_data = ocr_engine.image_to_data_regions(thresh, regions, psm=PIPELINE_CONFIG['psm'])
+            else:
+                ocr_data = ocr_engine.image_to_data(thresh, psm=PIPELINE_CONFIG['psm'])
+        with timed(stats, 'parse'):
+            raw_result = parse_ocr_data(ocr_data)
+    if PIPELINE_CONFIG['two_pass']:
+        with timed(stats, 'reread'):
+            reread_marks(thresh, raw_result, stats)
+    with timed(stats, 'clean'):
+        return clean_result_data(raw_result)
+
+def triage_page(gray, stats=None):
+    # Clean scans keep the configured threshold; poor photos get only the cleanup their
+    # statistics call for. Returns (page, threshold method).
+    with timed(stats, 'triage'):
+        quality = preprocess.assess_quality(gray)
+        route, reasons = preprocess.triage(quality, PIPELINE_CONFIG['quality_limits'])
+    PREPROCESS_ROUTES.inc(route=route)
+    if stats is not None:
+        stats['quality'] = dict(quality, route=route, reasons=reasons)
+    if route == 'cheap':
+        return gray, PIPELINE_CONFIG['threshold']
+    with timed(stats, 'cleanup'):
+        return preprocess.clean_up(gray, quality, reasons, PIPELINE_CONFIG['threshold'], buffers=buffer_pool)
+
+def extract_tiled(gray, stats=None):
+    # Very large pages: one global Otsu level, then threshold and OCR overlapping strips
+    # through a single reused strip buffer, so no page-sized binary copy is ever made.
+    # Layout templates, text-region cropping and quality triage need the whole page and are skipped.
+    with timed(stats, 'threshold'):
+        level = preprocess.otsu_level(gray)
+    height, width = gray.shape
+    bands = preprocess.strips(height, width, PIPELINE_CONFIG['tile_bytes'], 3 * PIPELINE_CONFIG['text_height'])
+    if stats is not None:
+        stats['tiles'] = len(bands)
+
+    def tiles():
+        for top, bottom, keep_top, keep_bottom in bands:
+            strip = buffer_pool.get('strip', (bottom - top, width))
+            cv2.threshold(gray[top:bottom], level, 255, cv2.THRESH_BINARY, dst=strip)
+            yield strip, top, keep_top, keep_bottom
+
+    with timed(stats, 'ocr'):
+        ocr_data = ocr_engine.image_to_data_tiles(tiles(), psm=PIPELINE_CONFIG['psm'])
+    with timed(stats, 'parse'):
+        raw_result = parse_ocr_data(ocr_data)
+    if PIPELINE_CONFIG['two_pass']:
+        with timed(stats, 'reread'):
+            reread_marks(gray, raw_result, stats, threshold=level)
+    with timed(stats, 'clean'):
+        return clean_result_data(raw_result)
+
+def extract_with_template(gray, library, method, stats=None):
+    # Known layout: align the page to it and read only the field boxes. (None, None) sends
+    # the page down the full-page path, as does a match that yields no subjects.
+    with timed(stats, 'register'):
+        match = library.register(gray)
+    if stats is not None:
+        stats['layout'] = match[0].name if match else None
+    if match is None:
+        return None, None
+    template, aligned, _ = match
+    with timed(stats, 'threshold'):
+        thresh = preprocess.binarize(aligned, method, dst=buffer_pool.get('binary', aligned.shape))
+    with timed(stats, 'ocr'):
+        raw_result = template.read_fields(thresh)
+    if not raw_result['subjects'] and not raw_result['unread_subjects']:
+        if stats is not None:
+            stats['layout'] = None
+        return None, None
+    return raw_result, thresh
+
+def reread_marks(image, raw_result, stats=None, threshold=None):
+    # Second pass: only the doubtful marks cells, as single lines restricted to mark characters
+    cells = reread_candidates(raw_result, PIPELINE_CONFIG['reread_conf'])[:PIPELINE_CONFIG['max_rereads']]
+    fixed = 0
+    if cells:
+        reads = ocr_engine.read_cells(image, [box for _, box in cells], whitelist=MARK_CHARACTERS,
+                                      threshold=threshold)
+        fixed = sum(apply_reread(raw_result, subject, data) for (subject, _), data in zip(cells, reads))
+    if stats is not None:
+        stats['reread'] = {'cells': len(cells), 'fixed': fixed}
+    return raw_result
+
+def extract_data_from_bytes(image_bytes, stats=None):
+    if not image_bytes:
+        return {'error': 'Could not read image file'}
+    try:
+        with timed(stats, 'decode'):
+            image = preprocess.decode_image(image_bytes, PIPELINE_CONFIG['min_decode_long_side'], stats=stats,
+                                            max_pixels=MAX_PIXELS)
+    except ValueError as e:
+        return {'error': str(e)}
+    return extract_data_from_image(image, stats=stats)
+
+def extract_data_cached(image_bytes, image=None, stats=None, block=False, digest=None, filename=None):
+    digest = digest or hashlib.sha256(image_bytes).hexdigest()
+    key = make_key(image_bytes, PIPELINE_CONFIG, digest)
+    with timed(stats, 'cache'):
+        data = result_cache.get(key)
+    cache_hit = data is not None
+    if stats is not None:
+        stats['cache_hit'] = cache_hit
+    if data is None:
+        try:
+            with ocr_limiter.admit(block=block) as waited:
+                ADMISSION_WAIT_SECONDS.observe(waited)
+                if stats is not None:
+                    stats.setdefault('timings', {})['admission_wait'] = waited
+                if image is not None:
+                    data = extract_data_from_image(image, stats=stats)
+                else:
+                    data = extract_data_from_bytes(image_bytes, stats=stats)
+        except Overloaded as e:
+            ADMISSION_REJECTED.inc(reason=e.reason)
+            raise
+        if 'error' not in data:
+            result_cache.put(key, data)
+            store_result(digest, data, filename, timings=stats.get('timings') if stats else None)
+    record_extraction(data, len(image_bytes), cache_hit)
+    return data
+
+def get_result_store():
+    global _result_store
+    if RESULT_DB is None:
+        return None
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore(RESULT_DB)
+        return _result_store
+
+def store_result(digest, data, filename=None, page=None, timings=None):
+    store = get_result_store()
+    if store is None:
+        return
+    if timings:
+        timings = {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+    store.add(digest, data, filename=filename, page=page, timings=timings)
+
+def process_upload(payload):
+    # Decode once, and only if needed: the same array feeds OCR and the results-page
+    # thumbnail, so a resubmitted sheet with both still cached never decodes at all
+    image_bytes, digest, filename = payload
+    thumbnail_key = digest[:32]
+    image = None
+    result_cached = make_key(image_bytes, PIPELINE_CONFIG, digest) in result_cache
+    if not result_cached or thumbnail_cache.get(thumbnail_key) is None:
+        try:
+            with timed(None, 'decode'):
+                image = preprocess.decode_image(image_bytes, PIPELINE_CONFIG['min_decode_long_side'],
+                                                max_pixels=MAX_PIXELS)
+        except ValueError as e:
+            record_extraction({'error': 'too_large'}, len(image_bytes), False)
+            return {'error': str(e)}
+        if image is None:
+            record_extraction({'error': 'undecodable'}, len(image_bytes), False)
+            return {'error': 'Could not read image file'}
+        with timed(None, 'thumbnail'):
+            thumbnail = preprocess.make_thumbnail(image, app.config['THUMBNAIL_SIZE'])
+        if thumbnail:
+            thumbnail_cache.put(thumbnail_key, thumbnail)
+    return extract_data_cached(image_bytes, image=image, block=True, digest=digest, filename=filename)
+
+job_queue = JobQueue(
+    process_upload,
+    workers=app.config['JOB_WORKERS'],
+    max_depth=app.config['JOB_QUEUE_DEPTH'],
+    ttl=app.config['JOB_TTL']
+)
+metrics_registry.gauge('job_queue_depth', 'Jobs waiting for a worker', lambda: {(): job_queue.depth()})
 
 def clean_result_data(raw_result):
     cleaned = {
@@ -93,6 +429,7 @@ def clean_result_data(raw_result):
         name_cleaned = [part for part in name_parts if part.upper() not in {'INDEX', 'NO', 'CERTIFICATE'}]
         cleaned['name'] = ' '.join(name_cleaned).strip().title()
 
+    confidences = {}
     for subject in raw_result.get('subjects', []):
         mark = subject['marks']
         if mark > 100:
@@ -102,686 +439,541 @@ def clean_result_data(raw_result):
                 'subject': subject['subject'].title(),
                 'marks': mark
             })
+            confidences[subject['subject'].title()] = subject.get('confidence')
+
+    if raw_result.get('index_number'):
+        cleaned['index_number'] = raw_result['index_number']
+
+    if 'name_confidence' in raw_result:
+        cleaned['confidence'] = {
+            'name': raw_result['name_confidence'] if cleaned['name'] else None,
+            'subjects': confidences
+        }
 
     return cleaned
 
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def _init_batch_worker():
+    # Each worker runs its own tesseract; keep it to one thread so N workers use N cores
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    os.environ['OCR_WORKERS'] = '1'
+    ocr_engine.get_engine()
+
+def batch_mp_context():
+    # Workers start from a fresh interpreter via the fork server rather than forking this
+    # process: a fork would inherit the parent's OCR engine (sized for every core, so the
+    # initializer's limits would do nothing) and the locks of its running threads
+    return multiprocessing.get_context('forkserver')
+
+def get_batch_pool():
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=app.config['BATCH_WORKERS'],
+                mp_context=batch_mp_context(),
+                initializer=_init_batch_worker
+            )
+        return _batch_pool
+
+def reset_batch_pool(broken=None):
+    # With `broken`, only replace the pool if nobody has replaced it already
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is not None and broken in (None, _batch_pool):
+            _batch_pool.shutdown(wait=False, cancel_futures=True)
+            _batch_pool = None
+
+def extract_batch_item(image_bytes):
+    try:
+        return extract_data_from_bytes(image_bytes)
+    except Exception as e:
+        return {'error': str(e)}
+
+def extract_pdf_page(path, page_index):
+    # Runs in a batch worker: each worker rasterizes only the page it was given
+    try:
+        return extract_data_from_image(pdf_pages.render_page(path, page_index, max_pixels=MAX_PIXELS))
+    except Exception as e:
+        return {'error': str(e)}
+
+def save_pdf(stream):
+    # Workers open the PDF by path, so it goes to disk; hashed on the way for the cache key
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return path, digest.hexdigest()
+
+def collect_pdf(filename, stream, pdf_paths):
+    if not pdf_pages.PDF_AVAILABLE:
+        return {'filename': filename, 'error': 'PDF support is not installed'}
+    path, digest = save_pdf(stream)
+    pdf_paths.append(path)
+    try:
+        pages = pdf_pages.page_count(path)
+    except Exception:
+        return {'filename': filename, 'error': 'Could not read PDF file'}
+    return {'filename': filename, 'pdf': path, 'digest': digest, 'pages': pages}
+
+def collect_zip(filename, stream, pdf_paths):
+    # Members are read one at a time as the batch reaches them. Each is checked by its
+    # declared size, which zipfile never reads past, against the upload limit, and all of
+    # them against BATCH_MAX_UNZIPPED_BYTES, so a zip bomb is refused before it is inflated.
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        yield {'filename': filename, 'error': 'Could not read zip file'}
+        return
+    unzipped = 0
+    with archive:
+        for info in archive.infolist():
+            member = info.filename
+            extension = os.path.splitext(member)[1].lower()
+            if info.is_dir() or member.startswith('__MACOSX/'):
+                continue
+            if extension != '.pdf' and extension not in BATCH_IMAGE_EXTENSIONS:
+                continue
+            if info.file_size > app.config['MAX_CONTENT_LENGTH']:
+                yield {'filename': member, 'error': 'File is larger than the upload limit'}
+                continue
+            unzipped += info.file_size
+            if unzipped > app.config['BATCH_MAX_UNZIPPED_BYTES']:
+                yield {'filename': member, 'error': 'Zip contents exceed the batch size limit'}
+                continue
+            try:
+                with archive.open(info) as member_stream:
+                    # Members get the same type and pixel-count checks as uploaded files;
+                    # an image is checked whole, so its size is read wherever it sits
+                    head = member_stream.read(HEADER_BYTES)
+                    fmt, _ = inspect_header(head)
+                    if fmt == 'zip' or (extension == '.pdf') != (fmt == 'pdf'):
+                        raise UnsupportedMediaType('Unsupported file type inside zip')
+                    if fmt == 'pdf':
+                        member_stream.seek(0)
+                        item = collect_pdf(member, member_stream, pdf_paths)
+                    else:
+                        image_bytes = head + member_stream.read()
+                        inspect_header(image_bytes, complete=True)
+                        item = {'filename': member, 'image': image_bytes}
+            except (RequestEntityTooLarge, UnsupportedMediaType) as e:
+                item = {'filename': member, 'error': e.description}
+            except (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError):
+                # Corrupt, encrypted or unsupported compression
+                item = {'filename': member, 'error': 'Could not read file from zip'}
+            yield item
+
+def collect_batch_files(files, pdf_paths):
+    # A generator, so zip members are only read once run_batch has room for them
+    for file in files:
+        filename = secure_filename(file.filename or '')
+        rejection = getattr(file.stream, 'rejection', None)
+        if rejection is not None:
+            # Refused while streaming in; the other files in the request still run
+            UPLOADS_REJECTED.inc(reason='too_large' if rejection.code == 413 else 'unsupported_type')
+            yield {'filename': filename, 'error': rejection.description}
+            continue
+        head = file.stream.read(5)
+        file.stream.seek(0)
+        if filename.lower().endswith('.pdf') or pdf_pages.is_pdf(head):
+            yield collect_pdf(filename, file.stream, pdf_paths)
+        elif filename.lower().endswith('.zip'):
+            yield from collect_zip(filename, file.stream, pdf_paths)
+        else:
+            yield {'filename': filename, 'image': file.read(), 'digest': getattr(file.stream, 'sha256', None)}
+
+def batch_tasks(items):
+    # (record fields, error, upload size, cache key, file digest, worker call); a PDF becomes one task per page
+    for item in items:
+        fields = {'filename': item['filename']}
+        if 'error' in item:
+            yield fields, item['error'], None, None, None, None
+        elif 'pdf' in item:
+            pages = min(item['pages'], pdf_pages.MAX_PDF_PAGES)
+            for page_index in range(pages):
+                config = dict(PIPELINE_CONFIG, pdf_page=page_index, pdf_dpi=pdf_pages.PDF_DPI)
+                key = make_key(item['digest'].encode('ascii'), config)
+                yield (dict(fields, page=page_index + 1), None, None, key, item['digest'],
+                       (extract_pdf_page, item['pdf'], page_index))
+            if item['pages'] > pages:
+                # Pages past the limit get one entry rather than failing the pages that were read
+                yield (dict(fields, page=pages + 1),
+                       f'{item["pages"] - pages} page(s) after page {pages} were not read; the limit is {pages} per PDF',
+                       None, None, None, None)
+        else:
+            image_bytes = item['image']
+            digest = item.get('digest') or hashlib.sha256(image_bytes).hexdigest()
+            key = make_key(image_bytes, PIPELINE_CONFIG, digest)
+            yield fields, None, len(image_bytes), key, digest, (extract_batch_item, image_bytes)
+
+def submit_batch_call(call):
+    # Batch pages share the OCR slots with interactive extractions; each slot is held
+    # until its worker finishes, so BATCH_WORKERS cannot oversubscribe OCR_SLOTS
+    ADMISSION_WAIT_SECONDS.observe(ocr_limiter.acquire(block=True))
+    try:
+        pool = get_batch_pool()
+        try:
+            future = pool.submit(*call)
+        except BrokenProcessPool:
+            # A worker died since the pool was handed out; start a fresh one
+            reset_batch_pool(pool)
+            pool = get_batch_pool()
+            future = pool.submit(*call)
+    except BaseException:
+        ocr_limiter.release()
+        raise
+    future.add_done_callback(lambda _: ocr_limiter.release())
+    return pool, future
+
+def batch_result(pool, future, call):
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        # A dead worker fails every task in flight on its pool, not just its own. Rerun
+        # this one by itself on a fresh pool: only a task that crashes that too is at fault.
+        reset_batch_pool(pool)
+    pool, future = submit_batch_call(call)
+    try:
+        return future.result()
+    except Exception as e:
+        reset_batch_pool(pool)
+        return {'error': str(e) or 'OCR worker crashed'}
+
+def finish_batch_task(fields, error, size, key, digest, cached, pool, future, call):
+    if error is not None:
+        data = {'error': error}
+    elif future is None:
+        data = cached
+        record_extraction(data, size, True)
+    else:
+        data = batch_result(pool, future, call)
+        if 'error' not in data:
+            result_cache.put(key, data)
+            store_result(digest, data, fields['filename'], fields.get('page'))
+        record_extraction(data, size, False)
+    data.update(fields)
+    return data
+
+def run_batch(tasks, window):
+    # Results come back in input order. At most `window` tasks are in flight, so a long
+    # PDF is rasterized a few pages at a time rather than all up front.
+    pending = deque()
+    for fields, error, size, key, digest, call in tasks:
+        cached = result_cache.get(key) if key else None
+        pool = future = None
+        if error is None and cached is None:
+            pool, future = submit_batch_call(call)
+        pending.append((fields, error, size, key, digest, cached, pool, future, call))
+        if len(pending) >= window:
+            yield finish_batch_task(*pending.popleft())
+    while pending:
+        yield finish_batch_task(*pending.popleft())
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No file uploaded'})
+
+    pdf_paths = []
+    try:
+        items = collect_batch_files(files, pdf_paths)
+        results = list(run_batch(batch_tasks(items), app.config['BATCH_WINDOW']))
+    finally:
+        for path in pdf_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    return jsonify({'count': len(results), 'results': results})
+
+def busy_response(response):
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    response = jsonify({'error': 'Server is busy, try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(RequestEntityTooLarge)
+@app.errorhandler(UnsupportedMediaType)
+def upload_rejected(e):
+    # Raised while the body streams in (uploads.ValidatingSpool) or by MAX_CONTENT_LENGTH
+    UPLOADS_REJECTED.inc(reason='too_large' if e.code == 413 else 'unsupported_type')
+    return jsonify({'error': e.description}), e.code
+
+def check_image_upload(stream):
+    # PDFs and zips pass the streaming check for /batch; single-image endpoints refuse them here
+    if getattr(stream, 'format', None) in ('pdf', 'zip'):
+        raise UnsupportedMediaType('Upload a single image file, or use /batch for PDF and zip files')
+
+def upload_digest(stream, image_bytes):
+    return getattr(stream, 'sha256', None) or hashlib.sha256(image_bytes).hexdigest()
+
+def compact_json(payload, status=200):
+    return app.response_class(json.dumps(payload, separators=(',', ':')), status=status,
+                              mimetype='application/json')
+
+@app.route('/api/extract', methods=['POST'])
+def api_extract():
+    # Just the extracted record: no image echo, no HTML. ?confidence=1 and ?timings=1 add detail.
+    if 'file' not in request.files:
+        return compact_json({'error': 'No file uploaded'}, 400)
+    file = request.files['file']
+    check_image_upload(file.stream)
+    stats = {}
+    start = time.perf_counter()
+    with file.stream, upload_buffer(file.stream) as img_bytes:
+        data = extract_data_cached(img_bytes, stats=stats, digest=upload_digest(file.stream, img_bytes),
+                                   filename=secure_filename(file.filename))
+    confidence = data.pop('confidence', None)
+    if 'error' in data:
+        return compact_json(data, 422)
+
+    if request.args.get('confidence', type=int) and confidence:
+        data['confidence'] = confidence
+    if request.args.get('timings', type=int):
+        timings = {stage: round(seconds * 1000, 2) for stage, seconds in stats.get('timings', {}).items()}
+        timings['total'] = round((time.perf_counter() - start) * 1000, 2)
+        data['timings_ms'] = timings
+        data['cached'] = stats['cache_hit']
+    return compact_json(data)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+    file = request.files['file']
+    check_image_upload(file.stream)
+    with file.stream, upload_buffer(file.stream) as img_bytes:
+        image_bytes = bytes(img_bytes)
+    digest = upload_digest(file.stream, image_bytes)
+    try:
+        filename = secure_filename(file.filename)
+        job = job_queue.submit((image_bytes, digest, filename), filename=filename, thumbnail_key=digest[:32])
+    except QueueFull:
+        return busy_response(jsonify({'error': 'Too many uploads in progress, try again shortly'}))
+    return jsonify(job.to_dict()), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    # Long-poll: ?wait=N holds the request until the job finishes or N seconds pass
+    wait = min(request.args.get('wait', 0, type=float), app.config['JOB_MAX_WAIT'])
+    if wait > 0:
+        job.done.wait(wait)
+    return jsonify(job.to_dict())
+
+@app.route('/results/<job_id>')
+def job_results(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return redirect(url_for('index'))
+    if not job.done.is_set():
+        position = job_queue.position(job)
+        with timed(None, 'render'):
+            return render_template('pending.html', filename=job.meta['filename'], position=position)
+
+    data = dict(job.result) if job.status == 'done' else {'error': job.error}
+    data['image_url'] = url_for('thumbnail', key=job.meta['thumbnail_key'])
+    data['image_filename'] = job.meta['filename']
+    with timed(None, 'render'):
+        return render_template('results.html', data=data)
+
+@app.route('/thumbnails/<key>.jpg')
+def thumbnail(key):
+    # Content-hashed URLs never change meaning, so browsers may keep them for the job's lifetime
+    if request.if_none_match.contains(key):
+        return '', 304
+    blob = thumbnail_cache.get(key)
+    if blob is None:
+        return '', 404
+    response = app.response_class(blob, mimetype='image/jpeg')
+    response.set_etag(key)
+    response.headers['Cache-Control'] = f"private, max-age={app.config['JOB_TTL']}, immutable"
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return app.response_class(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+def check_records_access():
+    # Stored results are personal data: a 404 unless the store and RECORDS_TOKEN are both set,
+    # then a 401 for any request without "Authorization: Bearer <RECORDS_TOKEN>"
+    if RESULT_DB is None or RECORDS_TOKEN is None:
+        return jsonify({'error': 'Records API is disabled'}), 404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {RECORDS_TOKEN}'.encode()):
+        response = jsonify({'error': 'Authentication required'})
+        response.status_code = 401
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    return None
+
+@app.route('/records')
+def records():
+    # ?name= (prefix, case-insensitive), ?index_number=, ?image_hash=; served from the indexes
+    refused = check_records_access()
+    if refused:
+        return refused
+    store = get_result_store()
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    found = store.find(
+        name=request.args.get('name'),
+        index_number=request.args.get('index_number'),
+        image_hash=request.args.get('image_hash'),
+        limit=limit
+    )
+    return jsonify({'count': len(found), 'results': found})
+
+@app.route('/records/export')
+def export_records():
+    refused = check_records_access()
+    if refused:
+        return refused
+    store = get_result_store()
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in ('jsonl', 'csv'):
+        return jsonify({'error': 'format must be jsonl or csv'}), 400
+
+    def rows():
+        # One record at a time from the cursor straight into the response
+        if fmt == 'jsonl':
+            for record in store.iter_all():
+                yield json.dumps(record, separators=(',', ':')) + '\n'
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(RECORD_COLUMNS)
+        for record in store.iter_all():
+            record['subjects'] = '; '.join(f'{s["subject"]}={s["marks"]}' for s in record['subjects'])
+            for column in ('confidence', 'timings'):
+                if record[column] is not None:
+                    record[column] = json.dumps(record[column])
+            writer.writerow([record[column] for column in RECORD_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return app.response_class(rows(), mimetype=mimetype,
+                              headers={'Content-Disposition': f'attachment; filename=results.{fmt}'})
+
+@app.route('/records/stats')
+def records_stats():
+    refused = check_records_access()
+    if refused:
+        return refused
+    return jsonify(get_result_store().stats())
+
+_warm_up_done = threading.Event()
+
+def warm_up():
+    # Pays the OCR stack's import and tesseract start-up before the first upload does
+    try:
+        for module in (cv2, preprocess, ocr_engine, pdf_pages, layout_templates):
+            startup.load(module)
+        with startup.timed_step('start tesseract'):
+            ocr_engine.get_engine()
+        if LAYOUT_TEMPLATE_DIR:
+            with startup.timed_step('load layout templates'):
+                get_template_library()
+    except Exception:
+        logger.exception('warm-up failed; the OCR stack will load on first use')
+    finally:
+        _warm_up_done.set()
+        logger.info('startup report: %s', json.dumps(startup.report()))
+
+def start_warm_up():
+    # WARM_UP=0 leaves everything to first use, e.g. for one-off scripts
+    if not OCR_AVAILABLE or os.environ.get('WARM_UP', '1') == '0':
+        _warm_up_done.set()
+        return
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: touches nothing heavy, so it answers as soon as the process is up.
+    # `ready` turns true once the OCR stack is loaded.
+    return jsonify({
+        'status': 'ok',
+        'ready': _warm_up_done.is_set() and startup.is_loaded(ocr_engine),
+        'uptime_seconds': startup.report()['uptime_seconds'],
+    })
+
+@app.route('/startup')
+def startup_report():
+    return jsonify(startup.report())
+
+@app.route('/ocr/stats')
+def ocr_stats():
+    return jsonify(ocr_engine.get_engine().snapshot())
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
+    global _upload_page
     example_triggered = request.form.get("example") == "true"
     if request.method == 'POST':
         if example_triggered:
             # Load example image from static folder
-            path = os.path.join(app.root_path, "static", "example.png")
             filename = "example.png"
+            stream = open(os.path.join(app.root_path, "static", filename), "rb")
         else:
             if 'file' not in request.files:
                 return jsonify({'error': 'No file uploaded'})
             file = request.files['file']
             filename = secure_filename(file.filename)
-            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(path)
-        # if 'file' not in request.files:
-        #     return jsonify({'error': 'No file uploaded'})
-
-        # file = request.files['file']
-        # filename = secure_filename(file.filename)
-        # path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        # file.save(path)
-        
-        # Convert image to base64 for display
-        with open(path, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-        
-        data = extract_data_from_image(path)
-        data['image_data'] = img_base64
-        data['image_filename'] = filename
-        
-        if os.path.exists(path):
-            os.remove(path)
-
-        # Results page with minimalistic design
-        return render_template_string("""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Results</title>
-            <style>
-                * {
-                    margin: 0;
-                    padding: 0;
-                    box-sizing: border-box;
-                .error {
-                    color: #dc3545;
-                    background: #f8d7da;
-                    border: 1px solid #f5c6cb;
-                    padding: 16px;
-                    border-radius: 6px;
-                    text-align: center;
-                    margin-bottom: 24px;
-                }
-                
-                body {
-                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                    background: #fafafa;
-                    color: #333;
-                    line-height: 1.6;
-                    padding: 40px 20px;
-                }
-                
-                .container {
-                    max-width: 1000px;
-                    margin: 0 auto;
-                }
-                
-                .content {
-                    display: grid;
-                    grid-template-columns: 1fr 1fr;
-                    gap: 32px;
-                    align-items: start;
-                }
-                
-                .header {
-                    text-align: center;
-                    margin-bottom: 40px;
-                }
-                
-                .header h1 {
-                    font-size: 1.5rem;
-                    font-weight: 600;
-                    color: #1a1a1a;
-                    margin-bottom: 8px;
-                }
-                
-                .header p {
-                    color: #666;
-                    font-size: 0.9rem;
-                }
-                
-                .image-section {
-                    position: sticky;
-                    top: 20px;
-                }
-                
-                .image-container {
-                    background: white;
-                    border-radius: 8px;
-                    border: 1px solid #e5e5e5;
-                    padding: 20px;
-                    text-align: center;
-                }
-                
-                .image-title {
-                    font-size: 0.9rem;
-                    color: #666;
-                    margin-bottom: 16px;
-                    font-weight: 500;
-                }
-                
-                .uploaded-image {
-                    max-width: 100%;
-                    height: auto;
-                    border-radius: 6px;
-                    border: 1px solid #e5e5e5;
-                    box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-                }
-                
-                .image-info {
-                    margin-top: 12px;
-                    font-size: 0.8rem;
-                    color: #999;
-                }
-                
-                .student-name {
-                    font-size: 1.25rem;
-                    font-weight: 500;
-                    color: #1a1a1a;
-                    text-align: center;
-                    margin-bottom: 32px;
-                    padding-bottom: 16px;
-                    border-bottom: 1px solid #f0f0f0;
-                }
-                
-                .stats {
-                    display: grid;
-                    grid-template-columns: repeat(3, 1fr);
-                    gap: 16px;
-                    margin-bottom: 32px;
-                }
-                
-                .stat {
-                    text-align: center;
-                    padding: 16px;
-                    background: #f8f9fa;
-                    border-radius: 6px;
-                }
-                
-                .stat-value {
-                    font-size: 1.5rem;
-                    font-weight: 600;
-                    color: #1a1a1a;
-                    margin-bottom: 4px;
-                }
-                
-                .stat-label {
-                    font-size: 0.75rem;
-                    color: #666;
-                    text-transform: uppercase;
-                    letter-spacing: 0.5px;
-                }
-                
-                .subjects {
-                    space-y: 12px;
-                }
-                
-                .subject {
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: center;
-                    padding: 16px 0;
-                    border-bottom: 1px solid #f0f0f0;
-                }
-                
-                .subject:last-child {
-                    border-bottom: none;
-                }
-                
-                .subject-name {
-                    font-size: 0.95rem;
-                    color: #1a1a1a;
-                    font-weight: 400;
-                }
-                
-                .subject-mark {
-                    font-size: 1rem;
-                    font-weight: 600;
-                    color: #666;
-                    background: #f5f5f5;
-                    padding: 4px 12px;
-                    border-radius: 20px;
-                    min-width: 50px;
-                    text-align: center;
-                }
-                
-                .actions {
-                    display: flex;
-                    gap: 12px;
-                    justify-content: center;
-                    margin-top: 32px;
-                }
-                
-                .btn {
-                    padding: 10px 20px;
-                    border: 1px solid #e5e5e5;
-                    border-radius: 6px;
-                    background: white;
-                    color: #333;
-                    text-decoration: none;
-                    font-size: 0.9rem;
-                    font-weight: 400;
-                    cursor: pointer;
-                    transition: all 0.2s ease;
-                }
-                
-                .btn:hover {
-                    background: #f8f9fa;
-                    border-color: #d0d0d0;
-                }
-                
-                .btn-primary {
-                    background: #1a1a1a;
-                    color: white;
-                    border-color: #1a1a1a;
-                }
-                
-                .btn-primary:hover {
-                    background: #333;
-                    border-color: #333;
-                }
-                
-                .card {
-                    background: white;
-                    border-radius: 8px;
-                    border: 1px solid #e5e5e5;
-                    padding: 32px;
-                    margin-bottom: 24px;
-                }
-                
-                .results-section {
-                    min-height: 400px;
-                }
-                
-                @media (max-width: 480px) {
-                    body { padding: 20px 16px; }
-                    .card { padding: 24px 20px; }
-                    .stats { grid-template-columns: 1fr; }
-                    .actions { flex-direction: column; }
-                    .image-container { padding: 16px; }
-                }
-                
-                .no-results {
-                    text-align: center;
-                    color: #666;
-                    font-size: 0.95rem;
-                    padding: 40px 20px;
-                }
-                
-                @media (max-width: 768px) {
-                    .content {
-                        grid-template-columns: 1fr;
-                        gap: 24px;
-                    }
-                    
-                    .image-section {
-                        order: 2;
-                        position: static;
-                    }
-                    
-                    .results-section {
-                        order: 1;
-                    }
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Academic Results</h1>
-                    <p>OCR extraction complete</p>
-                </div>
-                
-                <div class="content">
-                    <div class="results-section">
-                        <div class="card">
-                            {% if data.get('error') %}
-                                <div class="error">
-                                    {{ data.error }}
-                                </div>
-                            {% else %}
-                                <div class="student-name">
-                                    {{ data.name if data.name else 'Student Name Not Found' }}
-                                </div>
-                                
-                                {% if data.subjects %}
-                                    {% set total_marks = data.subjects | sum(attribute='marks') %}
-                                    {% set average = ((total_marks / data.subjects|length) / 5) | round(1) %}
-                                    
-                                    <div class="stats">
-                                        <div class="stat">
-                                            <div class="stat-value">{{ data.subjects|length }}</div>
-                                            <div class="stat-label">Subjects</div>
-                                        </div>
-                                        <div class="stat">
-                                            <div class="stat-value">{{ total_marks }}</div>
-                                            <div class="stat-label">Total</div>
-                                        </div>
-                                        <div class="stat">
-                                            <div class="stat-value">{{ average }}</div>
-                                            <div class="stat-label">Grade</div>
-                                        </div>
-                                    </div>
-                                    
-                                    <div class="subjects">
-                                        {% for subject in data.subjects %}
-                                            <div class="subject">
-                                                <div class="subject-name">{{ subject.subject }}</div>
-                                                <div class="subject-mark">{{ subject.marks }}</div>
-                                            </div>
-                                        {% endfor %}
-                                    </div>
-                                {% else %}
-                                    <div class="no-results">
-                                        No grade information found in the image.
-                                    </div>
-                                {% endif %}
-                            {% endif %}
-                            
-                            <div class="actions">
-                                <a href="/" class="btn btn-primary">Upload Another</a>
-                                <button onclick="window.print()" class="btn">Print</button>
-                            </div>
-                        </div>
-                    </div>
-                    
-                    {% if data.get('image_data') %}
-                    <div class="image-section">
-                        <div class="image-container">
-                            <div class="image-title">Uploaded Image</div>
-                            <img src="data:image/jpeg;base64,{{ data.image_data }}" 
-                                 alt="Uploaded academic result" 
-                                 class="uploaded-image">
-                            <div class="image-info">{{ data.image_filename }}</div>
-                        </div>
-                    </div>
-                    {% endif %}
-                </div>
-            </div>
-        </body>
-        </html>
-        """, data=data)
-
-    # Upload page with minimalistic design
-    return render_template_string("""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>OCR Grade Extractor</title>
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-            
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                background: #fafafa;
-                color: #333;
-                line-height: 1.6;
-                min-height: 100vh;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                padding: 40px 20px;
-            }
-            
-            .container {
-                background: white;
-                border-radius: 8px;
-                border: 1px solid #e5e5e5;
-                padding: 48px;
-                max-width: 500px;
-                width: 100%;
-            }
-            
-            .header {
-                text-align: center;
-                margin-bottom: 40px;
-            }
-            
-            .header h1 {
-                font-size: 1.5rem;
-                font-weight: 600;
-                color: #1a1a1a;
-                margin-bottom: 8px;
-            }
-            
-            .header p {
-                color: #666;
-                font-size: 0.9rem;
-            }
-            
-            .upload-area {
-                border: 2px dashed #d0d0d0;
-                border-radius: 8px;
-                padding: 48px 24px;
-                text-align: center;
-                background: #fafafa;
-                cursor: pointer;
-                transition: all 0.2s ease;
-                margin-bottom: 24px;
-                position: relative;
-            }
-            
-            .upload-area:hover,
-            .upload-area.dragover {
-                border-color: #999;
-                background: #f5f5f5;
-            }
-            
-            .upload-icon {
-                font-size: 2rem;
-                color: #999;
-                margin-bottom: 16px;
-                display: block;
-            }
-            
-            .upload-text {
-                font-size: 1rem;
-                color: #1a1a1a;
-                margin-bottom: 8px;
-                font-weight: 500;
-            }
-            
-            .upload-hint {
-                color: #666;
-                font-size: 0.85rem;
-            }
-            
-            .file-input {
-                position: absolute;
-                top: 0;
-                left: 0;
-                width: 100%;
-                height: 100%;
-                opacity: 0;
-                cursor: pointer;
-            }
-            
-            .selected-file {
-                background: #f0f9ff;
-                border: 1px solid #bfdbfe;
-                color: #1e40af;
-                padding: 12px;
-                border-radius: 6px;
-                font-size: 0.9rem;
-                margin-bottom: 16px;
-                display: none;
-            }
-            
-            .submit-btn {
-                background: #1a1a1a;
-                color: white;
-                border: none;
-                padding: 12px 24px;
-                border-radius: 6px;
-                cursor: pointer;
-                font-size: 0.9rem;
-                font-weight: 500;
-                width: 100%;
-                transition: background 0.2s ease;
-                display: none;
-            }
-            
-            .submit-btn:hover {
-                background: #333;
-            }
-            
-            .example-btn {
-                background: #1a1a1a;
-                color: white;
-                border: none;
-                padding: 12px 24px;
-                border-radius: 6px;
-                cursor: pointer;
-                font-size: 0.9rem;
-                font-weight: 500;
-                width: 100%;
-                transition: background 0.2s ease;
-            }
-            
-            .example-btn:hover {
-                background: #333;
-            }
-            
-            .loading {
-                display: none;
-                text-align: center;
-                margin-top: 16px;
-            }
-            
-            .loading-spinner {
-                width: 20px;
-                height: 20px;
-                border: 2px solid #f3f3f3;
-                border-top: 2px solid #1a1a1a;
-                border-radius: 50%;
-                animation: spin 1s linear infinite;
-                margin: 0 auto 12px;
-            }
-            
-            @keyframes spin {
-                0% { transform: rotate(0deg); }
-                100% { transform: rotate(360deg); }
-            }
-            
-            .loading p {
-                color: #666;
-                font-size: 0.9rem;
-            }
-            
-            .features {
-                margin-top: 32px;
-                padding-top: 24px;
-                border-top: 1px solid #f0f0f0;
-            }
-            
-            .feature {
-                display: flex;
-                align-items: center;
-                gap: 12px;
-                margin-bottom: 16px;
-            }
-            
-            .feature:last-child {
-                margin-bottom: 0;
-            }
-            
-            .feature-icon {
-                font-size: 1.25rem;
-                color: #666;
-            }
-            
-            .feature-text {
-                font-size: 0.85rem;
-                color: #666;
-            }
-            .example-preview{
-                width:100%,
-                height: auto,
-                display: 'flex',
-                justifyContent: 'center',
-                alignItems: 'center',
-                border: 1px solid #e5e5e5;
-                padding: 10px;
-                
-            }
-            @media (max-width: 480px) {
-                .container {
-                    padding: 32px 24px;
-                }
-                .upload-area {
-                    padding: 32px 20px;
-                }
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>Grade Extractor</h1>
-                <p>Upload an image to extract academic results</p>
-            </div>
-            
-            <form id="uploadForm" method="POST" enctype="multipart/form-data">
-                <div class="upload-area" id="uploadArea">
-                    <span class="upload-icon">📄</span>
-                    <div class="upload-text">Select an image</div>
-                    <div class="upload-hint">JPG, PNG, GIF, BMP supported</div>
-                    <input type="file" name="file" class="file-input" id="fileInput" accept="image/*" required>
-                </div>
-                
-                <div class="selected-file" id="selectedFile"></div>
-                
-                <button type="submit" class="submit-btn" id="submitBtn">
-                    Extract Results
-                </button>
-                
-                <div class="loading" id="loading">
-                    <div class="loading-spinner"></div>
-                    <p>Processing image...</p>
-                </div>
-            </form>
-            
-            <div class="example-preview">
-                <form method="POST">
-                    <input type="hidden" name="example" value="true">
-                    <button type="submit" class="example-btn">📄 Try Example Image</button>
-                </form>
-                <br>
-                <img src="/static/example.png" width = '200px'
-                height='150px' alt="Example Image">
-            </div>
-            
-            <div class="features">
-                <div class="feature">
-                    <span class="feature-icon">🔍</span>
-                    <span class="feature-text">Automatic text recognition</span>
-                </div>
-                <div class="feature">
-                    <span class="feature-icon">📊</span>
-                    <span class="feature-text">Grade extraction and analysis</span>
-                </div>
-                <div class="feature">
-                    <span class="feature-icon">⚡</span>
-                    <span class="feature-text">Fast processing</span>
-                </div>
-            </div>
-        </div>
-        
-        <script>
-            const uploadArea = document.getElementById('uploadArea');
-            const fileInput = document.getElementById('fileInput');
-            const selectedFile = document.getElementById('selectedFile');
-            const submitBtn = document.getElementById('submitBtn');
-            const uploadForm = document.getElementById('uploadForm');
-            const loading = document.getElementById('loading');
-            
-            uploadArea.addEventListener('dragover', (e) => {
-                e.preventDefault();
-                uploadArea.classList.add('dragover');
-            });
-            
-            uploadArea.addEventListener('dragleave', () => {
-                uploadArea.classList.remove('dragover');
-            });
-            
-            uploadArea.addEventListener('drop', (e) => {
-                e.preventDefault();
-                uploadArea.classList.remove('dragover');
-                const files = e.dataTransfer.files;
-                if (files.length > 0) {
-                    fileInput.files = files;
-                    showSelectedFile(files[0]);
-                }
-            });
-            
-            fileInput.addEventListener('change', (e) => {
-                if (e.target.files.length > 0) {
-                    showSelectedFile(e.target.files[0]);
-                }
-            });
-            
-            function showSelectedFile(file) {
-                selectedFile.innerHTML = `${file.name} (${(file.size / 1024 / 1024).toFixed(2)} MB)`;
-                selectedFile.style.display = 'block';
-                submitBtn.style.display = 'block';
-            }
-            
-            uploadForm.addEventListener('submit', () => {
-                submitBtn.style.display = 'none';
-                loading.style.display = 'block';
-            });
-        </script>
-        <footer>
-        <!-- <p>Created by Pravaat Chhetri</p> -->
-        </footer>
-    </body>
-    </html>
-    """)
+            stream = file.stream
+            check_image_upload(stream)
+
+        # The upload never touches a named file: the same buffer is hashed, decoded and shown
+        with timed(None, 'upload'), stream, upload_buffer(stream) as img_bytes:
+            image_bytes = bytes(img_bytes)
+        digest = upload_digest(stream, image_bytes)
+
+        # OCR runs on the job queue; the browser polls the results page until it is done
+        try:
+            job = job_queue.submit((image_bytes, digest, filename), filename=filename, thumbnail_key=digest[:32])
+        except QueueFull:
+            data = {'error': 'Too many uploads in progress, please try again in a few seconds'}
+            return busy_response(app.make_response(render_template('results.html', data=data)))
+        return redirect(url_for('job_results', job_id=job.id), code=303)
+
+    # Upload page with minimalistic design; it has no per-request content, so render it once
+    if _upload_page is None:
+        _upload_page = render_template('upload.html')
+    return _upload_page
+
+startup.record('import app', time.perf_counter() - startup.STARTED)
 
 if __name__ == '__main__':
+    start_warm_up()
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
@@ -0,0 +1,206 @@
+"""Search preprocessing and Tesseract settings for the best accuracy/latency trade-offs.
+
+    python -m benchmarks.autotune [--corpus DIR] [--workers N] [--out ocr_profile.json]
+
+Every combination of the grid options (text height, threshold method, page
+segmentation mode, text-region cropping, second pass, quality triage) is run over a
+labelled corpus by a pool of single-threaded tesseract workers, through
+app.extract_data_from_bytes.
+Each config is scored on field accuracy against the labels (the mean of the name
+and the subject/marks F1, as benchmarks.synthetic.score_result measures them) and
+on per-page latency. The configs no other config beats on both are written out as a
+profile; the app loads it with OCR_PROFILE=ocr_profile.json, using the profile's
+default or the config named by OCR_PROFILE_CONFIG.
+
+--corpus is a directory of scans plus labels.jsonl, one line per scan in the shape
+clean_result_data returns: {"file": "a.jpg", "name": "...", "subjects": [{"subject":
+"...", "marks": 78}, ...]}. Without it, synthetic sheets are generated.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2  # noqa: E402
+
+import app  # noqa: E402
+from benchmarks.run import ocr_available, percentile  # noqa: E402
+from benchmarks.synthetic import generate_sheet, score_result  # noqa: E402
+
+GRID_KEYS = ['text_height', 'threshold', 'psm', 'text_regions', 'two_pass', 'triage']
+_corpus = None
+
+
+def parse_psm(value):
+    return None if value == 'default' else int(value)
+
+
+def parse_flag(value):
+    return value in ('on', '1', 'true')
+
+
+def config_name(settings):
+    return '-'.join([
+        f'h{settings["text_height"]}',
+        settings['threshold'],
+        f'psm{settings["psm"]}' if settings['psm'] is not None else 'psmdefault',
+        'regions' if settings['text_regions'] else 'page',
+        'twopass' if settings['two_pass'] else 'onepass',
+        'triage' if settings['triage'] else 'notriage',
+    ])
+
+
+def load_corpus(directory):
+    cases = []
+    with open(os.path.join(directory, 'labels.jsonl'), encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            label = json.loads(line)
+            with open(os.path.join(directory, label['file']), 'rb') as image:
+                cases.append((label['file'], image.read(), label))
+    return cases
+
+
+def synthetic_corpus(sheets, scales, noise_levels):
+    cases = []
+    for scale in scales:
+        for noise in noise_levels:
+            for seed in range(sheets):
+                image, truth, _ = generate_sheet(seed=seed, scale=scale, noise=noise)
+                _, encoded = cv2.imencode('.png', image)
+                cases.append((f'synthetic-{scale}-{noise}-{seed}.png', encoded.tobytes(), truth))
+    return cases
+
+
+def _init_worker(images):
+    global _corpus
+    _corpus = images
+    app._init_batch_worker()
+
+
+def engine_name():
+    return app.ocr_engine.get_engine().name
+
+
+def run_case(settings, index):
+    # Runs in a worker: the settings are applied to this process's pipeline for the call
+    app.PIPELINE_CONFIG.update(settings)
+    start = time.perf_counter()
+    try:
+        data = app.extract_data_from_bytes(_corpus[index])
+    except Exception as e:
+        data = {'error': str(e)}
+    return data, time.perf_counter() - start
+
+
+def summarize(settings, outcomes, labels):
+    scores = [score_result(data, label) for (data, _), label in zip(outcomes, labels)]
+    name = sum(score['name'] for score in scores) / len(scores)
+    marks_f1 = sum(score['marks_f1'] for score in scores) / len(scores)
+    latencies = [seconds * 1000 for _, seconds in outcomes]
+    return {
+        'name': config_name(settings),
+        'settings': settings,
+        'accuracy': round((name + marks_f1) / 2, 4),
+        'name_accuracy': round(name, 4),
+        'marks_f1': round(marks_f1, 4),
+        'errors': sum('error' in data for data, _ in outcomes),
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p95_ms': round(percentile(latencies, 95), 1),
+    }
+
+
+def pareto_front(results):
+    # Fastest first; a config stays only if it is more accurate than every faster one
+    front = []
+    for result in sorted(results, key=lambda r: (r['p50_ms'], -r['accuracy'])):
+        if not front or result['accuracy'] > front[-1]['accuracy']:
+            front.append(result)
+    return front
+
+
+def pick_default(front, tolerance):
+    # The fastest config within `tolerance` of the best accuracy on the front
+    best = max(result['accuracy'] for result in front)
+    return next(result for result in front if result['accuracy'] >= best - tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', help='directory with scans and labels.jsonl (default: synthetic sheets)')
+    parser.add_argument('--sheets', type=int, default=3, help='synthetic sheets per scale and noise level')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.5, 1.0, 2.0])
+    parser.add_argument('--noise', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--text-heights', type=int, nargs='+', default=[24, 30, 36])
+    parser.add_argument('--thresholds', nargs='+', choices=['otsu', 'adaptive'], default=['otsu', 'adaptive'])
+    parser.add_argument('--psms', type=parse_psm, nargs='+', default=[None, 4, 6, 11],
+                        help="page segmentation modes; 'default' leaves tesseract's own")
+    parser.add_argument('--text-regions', type=parse_flag, nargs='+', default=[True, False], help='on/off')
+    parser.add_argument('--two-pass', type=parse_flag, nargs='+', default=[True], help='on/off')
+    parser.add_argument('--triage', type=parse_flag, nargs='+', default=[True, False],
+                        help='on/off: quality triage and the heavy chain for poor pages')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='accuracy the default config may give up for speed')
+    parser.add_argument('--workers', type=int, default=app.app.config['BATCH_WORKERS'])
+    parser.add_argument('--out', default='ocr_profile.json')
+    args = parser.parse_args()
+
+    # ocr_available starts no engine in this process; the workers each start their own
+    if not ocr_available():
+        sys.exit('autotune needs a working tesseract')
+    cases = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.sheets, args.scales, args.noise)
+    grid = [dict(zip(GRID_KEYS, values)) for values in itertools.product(
+        args.text_heights, args.thresholds, args.psms, args.text_regions, args.two_pass, args.triage)]
+    print(f'{len(grid)} configs x {len(cases)} pages on {args.workers} workers', file=sys.stderr)
+
+    # Every (config, page) pair is its own task so slow configs spread across workers.
+    # Workers run concurrently, one tesseract thread each, so latencies are per core.
+    start = time.perf_counter()
+    # The app's fork-server context: forked workers would inherit this process's engine
+    # and ignore the single-thread limit _init_worker sets
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=app.batch_mp_context(),
+                             initializer=_init_worker, initargs=([image for _, image, _ in cases],)) as pool:
+        engine = pool.submit(engine_name).result()
+        futures = [[pool.submit(run_case, settings, index) for index in range(len(cases))] for settings in grid]
+        results = []
+        for settings, config_futures in zip(grid, futures):
+            outcomes = [future.result() for future in config_futures]
+            results.append(summarize(settings, outcomes, [label for _, _, label in cases]))
+            print(f'\r{len(results)}/{len(grid)} configs', end='', file=sys.stderr, flush=True)
+    print(f'\nsearched in {time.perf_counter() - start:.0f}s', file=sys.stderr)
+
+    front = pareto_front(results)
+    default = pick_default(front, args.tolerance)
+    profile = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'ocr': engine,
+        },
+        'corpus': args.corpus or 'synthetic',
+        'pages': len(cases),
+        'default': default['name'],
+        'configs': front,
+        'evaluated': sorted(results, key=lambda r: (-r['accuracy'], r['p50_ms'])),
+    }
+    with open(args.out, 'w') as f:
+        json.dump(profile, f, indent=2)
+
+    for result in front:
+        marker = '*' if result is default else ' '
+        print(f'{marker} {result["name"]:45s} accuracy {result["accuracy"]:.3f}   '
+              f'p50 {result["p50_ms"]:8.1f} ms   p95 {result["p95_ms"]:8.1f} ms')
+    print(f'{len(front)} Pareto configs written to {args.out}; default {default["name"]}')
+
+
+if __name__ == '__main__':
+    main()
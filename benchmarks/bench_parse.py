@@ -0,0 +1,120 @@
+"""Per-page parse time of the old pandas parser (and keyword scan) against parsing.parse_ocr_data.
+
+    python benchmarks/bench_parse.py [--pages N] [--filler-lines N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsing import DIGIT_WORD_MAP, KNOWN_SUBJECT_KEYWORDS, parse_ocr_data  # noqa: E402
+
+SUBJECT_ROWS = [
+    ('ENGLISH', '56', 'FIVE SIX'), ('DZONGKHA', '57', 'FIVE SEVEN'),
+    ('PHYSICS', '79', 'SEVEN NINE'), ('CHEMISTRY', '88', 'EIGHT EIGHT'),
+    ('MATHEMATICS', '72', 'SEVEN TWO'),
+]
+
+
+def synthetic_page(filler_lines=20):
+    # Shaped like the example certificate: header and footer text, a name line,
+    # and the subject and marks columns coming back as separate blocks.
+    data = {column: [] for column in ['level', 'page_num', 'block_num', 'par_num', 'line_num',
+                                      'word_num', 'left', 'top', 'width', 'height', 'conf', 'text']}
+
+    def add(block, line, words, left, top):
+        for n, text in enumerate(words):
+            for column, value in zip(data, [5, 1, block, 1, line, n + 1, left + n * 120, top, 100, 30, 91, text]):
+                data[column].append(value)
+
+    for i in range(filler_lines // 2):
+        add(1, i + 1, ['BHUTAN', 'COUNCIL', 'FOR', 'SCHOOL', 'EXAMINATIONS'], 500, 40 + i * 40)
+    add(2, 1, ['Name', 'PRAVAAT', 'CHHETRI'], 60, 420)
+    add(2, 2, ['Index', 'No.', '012190080054'], 60, 490)
+    for i, (subject, digits, words) in enumerate(SUBJECT_ROWS):
+        add(3, i + 1, [subject], 200, 730 + i * 40)
+        add(4, i + 1, [digits] + words.split(), 1200, 730 + i * 40)
+    for i in range(filler_lines - filler_lines // 2):
+        add(5, i + 1, ['NOTE', 'The', 'pass', 'mark', 'for', 'each', 'subject'], 60, 1100 + i * 40)
+    return data
+
+
+def merge_subject_keywords(line_words):
+    full_line = ' '.join(line_words).upper()
+    subjects = [kw for kw in KNOWN_SUBJECT_KEYWORDS if kw in full_line]
+    return ' '.join(sorted(set(subjects))) if subjects else None
+
+
+def extract_digit_word_marks(words):
+    digit_words = [w.upper() for w in words if w.upper() in DIGIT_WORD_MAP]
+    if len(digit_words) >= 2:
+        return int(''.join(DIGIT_WORD_MAP[w] for w in digit_words[:3]))
+    return None
+
+
+def legacy_parse(ocr_data):
+    import pandas as pd
+
+    data = pd.DataFrame(ocr_data)
+    data = data[(data.conf > 0) & (data.text.str.strip() != '')].reset_index(drop=True)
+    lines = data.groupby('line_num')
+
+    extracted_subjects = []
+    name = None
+
+    name_line = data[data['text'].str.contains('Name', case=False, na=False)]
+    if not name_line.empty:
+        idx = name_line.index[0]
+        parts = data.loc[idx+1:idx+4, 'text'].tolist()
+        name = ' '.join([w.title() for w in parts if w.isalpha()])
+
+    for line_num, group in lines:
+        words = group.sort_values('left')['text'].tolist()
+        subject = merge_subject_keywords(words)
+        if not subject:
+            continue
+        all_words = list(words)
+        if (line_num + 1) in lines.groups:
+            all_words += data[data['line_num'] == (line_num + 1)]['text'].tolist()
+        word_based_mark = extract_digit_word_marks(all_words)
+        digit_marks = [int(w) for w in all_words if w.isdigit() and 30 <= int(w) <= 100]
+        mark = word_based_mark or (digit_marks[0] if digit_marks else None)
+        if mark:
+            subject_name = ' '.join(sorted(set(subject.title().split())))
+            if not any(s['subject'] == subject_name for s in extracted_subjects):
+                extracted_subjects.append({"subject": subject_name, "marks": mark})
+
+    return {'name': name, 'subjects': extracted_subjects}
+
+
+def time_per_page(parse, data, pages):
+    return min(timeit.repeat(lambda: parse(data), number=pages, repeat=5)) / pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--filler-lines', type=int, default=20)
+    args = parser.parse_args()
+
+    data = synthetic_page(args.filler_lines)
+    words = sum(1 for t in data['text'] if t.strip())
+    print(f'{words} words per page, best of 5 runs of {args.pages} pages')
+    print(f'  new:    {parse_ocr_data(data)}')
+    try:
+        print(f'  pandas: {legacy_parse(data)}')
+        before = time_per_page(legacy_parse, data, args.pages)
+        print(f'before (pandas): {before * 1000:8.3f} ms/page')
+    except ImportError:
+        before = None
+        print('before (pandas): skipped, pandas is not installed')
+    after = time_per_page(parse_ocr_data, data, args.pages)
+    print(f'after (index):   {after * 1000:8.3f} ms/page')
+    if before:
+        print(f'speedup:         {before / after:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""Closed-loop load test of a local instance of the app.
+
+    python -m benchmarks.loadtest --serve [--stub] [--concurrency 1 2 4 8 16 32]
+    python -m benchmarks.loadtest --url http://127.0.0.1:10000 --endpoint /api/extract
+
+Each of N client threads uploads a scan, waits for the finished result, and
+immediately sends the next one, for --duration seconds per concurrency level.
+Throughput and p50/p95/p99 latency are reported per level; 503s (the admission
+limiter or job queue turning work away) are counted apart from other errors.
+
+Endpoints, each measured up to its finished result:
+  /             upload form: POST, long-poll the job, then render the results page
+  /jobs         POST, then long-poll /jobs/<id> until the job is done
+  /api/extract  one synchronous POST
+
+--serve starts the app itself on a free loopback port (gunicorn with
+gunicorn.conf.py, or --server flask) with a throwaway result store. --stub sets
+OCR_ENGINE=stub there, so tesseract is replaced by canned image_to_data output (the
+words of a synthetic sheet, optionally after --stub-seconds) and what is measured
+is the web layer: upload handling, decode, preprocessing, parsing, the job queue
+and template rendering. Every upload gets a unique trailer so the result cache
+never answers for it, unless --allow-cache. Only loopback targets are accepted.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.run import percentile  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOOPBACK = {'127.0.0.1', 'localhost', '::1'}
+IMAGE_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.bmp': 'image/bmp',
+               '.tif': 'image/tiff', '.tiff': 'image/tiff', '.webp': 'image/webp', '.gif': 'image/gif'}
+
+
+def load_corpus(directory):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        content_type = IMAGE_TYPES.get(os.path.splitext(name)[1].lower())
+        if content_type:
+            with open(os.path.join(directory, name), 'rb') as f:
+                corpus.append((name, content_type, f.read()))
+    return corpus
+
+
+def synthetic_corpus(count):
+    import cv2
+    from benchmarks.synthetic import generate_sheet
+
+    corpus = []
+    for seed in range(count):
+        image, _, _ = generate_sheet(seed=seed, noise=seed % 3)
+        _, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        corpus.append((f'sheet-{seed}.jpg', 'image/jpeg', encoded.tobytes()))
+    return corpus
+
+
+def write_stub_data(path):
+    from benchmarks.synthetic import generate_sheet
+
+    _, _, words = generate_sheet(seed=0)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(words, f)
+
+
+def multipart(fields, filename, content_type, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: {content_type}\r\n\r\n'.encode())
+    parts.append(content)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """One keep-alive connection; reconnects after errors or a server-side close."""
+
+    def __init__(self, host, port, timeout):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                return response.status, dict(response.getheaders()), response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # A keep-alive connection the server had already closed; retry once on a new one
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def wait_for_job(client, job_id, deadline):
+    while time.monotonic() < deadline:
+        status, _, body = client.request('GET', f'/jobs/{job_id}?wait=10')
+        if status != 200:
+            return status
+        job = json.loads(body)
+        if job['status'] in ('done', 'failed'):
+            return 200 if job['status'] == 'done' else 500
+    return 504
+
+
+def upload(client, endpoint, item, allow_cache, timeout):
+    """Status code of one upload, followed through to its finished result."""
+    filename, content_type, content = item
+    if not allow_cache:
+        # Decoders ignore bytes after the image's end marker; the cache key does not
+        content = content + uuid.uuid4().bytes
+    body, body_type = multipart({}, filename, content_type, content)
+    headers = {'Content-Type': body_type}
+    deadline = time.monotonic() + timeout
+
+    status, response_headers, payload = client.request('POST', endpoint, body, headers)
+    if endpoint == '/api/extract':
+        return status
+    if endpoint == '/jobs':
+        if status != 202:
+            return status
+        return wait_for_job(client, json.loads(payload)['job_id'], deadline)
+    # Upload form: 303 to the results page, which shows a pending page until the job is done
+    if status != 303:
+        return status
+    results_path = urlsplit(response_headers['Location']).path
+    status = wait_for_job(client, results_path.rsplit('/', 1)[-1], deadline)
+    if status != 200:
+        return status
+    status, _, _ = client.request('GET', results_path)
+    return status
+
+
+def run_level(address, endpoint, corpus, concurrency, duration, allow_cache, timeout):
+    host, port = address
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def worker(offset):
+        client = Client(host, port, timeout)
+        n = offset
+        try:
+            while time.monotonic() < stop:
+                start = time.perf_counter()
+                try:
+                    status = upload(client, endpoint, corpus[n % len(corpus)], allow_cache, timeout)
+                except (OSError, http.client.HTTPException):
+                    status = 'connection'
+                    client.close()
+                except (ValueError, KeyError):
+                    # A response that is not what the endpoint should send
+                    status = 'malformed'
+                    client.close()
+                seconds = time.perf_counter() - start
+                n += concurrency
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 200:
+                        latencies.append(seconds * 1000)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'ok': len(latencies),
+        'rejected': statuses.get(503, 0),
+        'errors': total - len(latencies) - statuses.get(503, 0),
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'throughput': round(len(latencies) / elapsed, 2),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), RESULT_DB=os.path.join(workdir, 'results.db'))
+    env.pop('RESULT_CACHE_DIR', None)
+    if args.stub:
+        stub_data = os.path.join(workdir, 'stub_ocr.json')
+        write_stub_data(stub_data)
+        # The canned words are one page's; per-region reads would repeat them per crop
+        env.update(OCR_ENGINE='stub', OCR_STUB_DATA=stub_data, OCR_STUB_SECONDS=str(args.stub_seconds),
+                   OCR_TEXT_REGIONS='0')
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1', '--port', str(port),
+                   '--with-threads', '--no-reload', '--no-debugger']
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.close()
+            with open(log.name, errors='replace') as f:
+                sys.exit(f'server exited with {process.returncode}:\n{f.read()[-2000:]}')
+        try:
+            status, _, body = Client('127.0.0.1', port, 2).request('GET', '/healthz')
+            if status == 200:
+                return process, log, ('127.0.0.1', port)
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    sys.exit('server did not answer /healthz within 60s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='an already running local instance, e.g. http://127.0.0.1:10000')
+    target.add_argument('--serve', action='store_true', help='start the app on a free loopback port')
+    parser.add_argument('--server', choices=['gunicorn', 'flask'], default='gunicorn')
+    parser.add_argument('--stub', action='store_true', help='serve with OCR_ENGINE=stub')
+    parser.add_argument('--stub-seconds', type=float, default=0.0, help='simulated OCR time per page read')
+    parser.add_argument('--endpoint', choices=['/', '/jobs', '/api/extract'], default='/')
+    parser.add_argument('--corpus', help='directory of scans to upload (default: synthetic sheets)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--duration', type=float, default=20, help='seconds per concurrency level')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds before the first level')
+    parser.add_argument('--timeout', type=float, default=120, help='per upload, including the wait for its result')
+    parser.add_argument('--stop-p99-ms', type=float, help='stop once a level\'s p99 exceeds this')
+    parser.add_argument('--allow-cache', action='store_true', help='resend identical bytes so the result cache can hit')
+    parser.add_argument('--out', help='write the report here as JSON')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(6)
+    if not corpus:
+        sys.exit('no images in the corpus')
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    process = log = None
+    try:
+        if args.serve:
+            process, log, address = start_server(args, workdir)
+        else:
+            url = urlsplit(args.url)
+            if url.hostname not in LOOPBACK:
+                sys.exit('load tests only run against loopback addresses')
+            address = (url.hostname, url.port or 80)
+
+        print(f'{len(corpus)} images, endpoint {args.endpoint}, {args.duration:g}s per level', file=sys.stderr)
+        if args.warmup:
+            run_level(address, args.endpoint, corpus, 1, args.warmup, args.allow_cache, args.timeout)
+        levels = []
+        print(f'{"clients":>7} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"ok":>6} {"503":>5} {"errors":>6}')
+        for concurrency in args.concurrency:
+            level = run_level(address, args.endpoint, corpus, concurrency, args.duration,
+                              args.allow_cache, args.timeout)
+            levels.append(level)
+            p = [f'{level[k]:9.1f}' if level[k] is not None else f'{"-":>9}' for k in ('p50_ms', 'p95_ms', 'p99_ms')]
+            print(f'{concurrency:7d} {level["throughput"]:8.2f} {" ".join(p)} {level["ok"]:6d} '
+                  f'{level["rejected"]:5d} {level["errors"]:6d}', flush=True)
+            if args.stop_p99_ms and level['p99_ms'] and level['p99_ms'] > args.stop_p99_ms:
+                print(f'p99 above {args.stop_p99_ms:g} ms; stopping', file=sys.stderr)
+                break
+
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump({
+                    'endpoint': args.endpoint,
+                    'server': (args.server if args.serve else args.url),
+                    'ocr': 'stub' if args.stub else 'tesseract',
+                    'stub_seconds': args.stub_seconds if args.stub else None,
+                    'corpus': args.corpus or 'synthetic',
+                    'duration': args.duration,
+                    'levels': levels,
+                }, f, indent=2)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(30)
+            log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
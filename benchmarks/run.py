@@ -0,0 +1,185 @@
+"""Offline benchmark of the extraction pipeline on synthetic result sheets.
+
+    python -m benchmarks.run [--out bench_output.json] [--baseline previous.json]
+
+Each sheet is encoded as PNG and JPEG and run through app.extract_data_from_bytes
+itself; the per-stage timings (decode, normalize, quality triage and the heavy
+cleanup chain, template registration, threshold, regions, OCR, parse, the
+second-pass mark re-reads and clean) are the ones the pipeline records in its
+`stats`. Accuracy is also broken down by the route triage chose, to show whether
+the heavy chain pays for itself. Without a working tesseract the stub OCR backend
+stands in and returns the words as drawn, read once per page (no region crops or
+tiles), so the OCR and re-read timings are not meaningful and only parse/clean
+accuracy is measured. The run fails (exit 1) when a stage's p95 exceeds benchmarks/thresholds.json, when accuracy drops below its floor,
+or when a stage is slower than --baseline by more than --max-regression.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2  # noqa: E402
+
+import app  # noqa: E402
+from benchmarks.synthetic import generate_sheet, score_result  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGES = ['decode', 'normalize', 'triage', 'cleanup', 'register', 'threshold', 'regions', 'ocr', 'parse',
+          'reread', 'clean', 'total']
+
+
+def ocr_available():
+    # Checked without starting an engine, so the stub can still be chosen when this fails
+    if app.ocr_engine.TESSEROCR_AVAILABLE:
+        return True
+    try:
+        app.ocr_engine.pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def run_case(image_bytes, drawn_words, use_ocr):
+    if not use_ocr:
+        app.ocr_engine.get_engine().stub.data = drawn_words
+    stats = {}
+    start = time.perf_counter()
+    result = app.extract_data_from_bytes(image_bytes, stats=stats)
+    total = time.perf_counter() - start
+    timings = {stage: seconds * 1000 for stage, seconds in stats.get('timings', {}).items()}
+    timings['total'] = total * 1000
+    return timings, result, stats.get('quality', {}).get('route')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def summarize(cases):
+    summary = {}
+    for stage in STAGES:
+        values = [case['timings_ms'][stage] for case in cases if stage in case['timings_ms']]
+        if values:
+            summary[stage] = {
+                'p50_ms': percentile(values, 50),
+                'p95_ms': percentile(values, 95),
+                'mean_ms': sum(values) / len(values),
+            }
+    accuracy = {}
+    for field in ['name', 'marks_precision', 'marks_recall', 'marks_f1']:
+        values = [case['accuracy'][field] for case in cases if case.get('accuracy')]
+        if values:
+            accuracy[field] = sum(values) / len(values)
+    return summary, accuracy
+
+
+def check(report, thresholds, baseline, max_regression):
+    failures = []
+    for stage, limit in thresholds.get('max_p95_ms', {}).items():
+        stats = report['summary'].get(stage)
+        if stats and stats['p95_ms'] > limit:
+            failures.append(f'{stage}: p95 {stats["p95_ms"]:.1f} ms > {limit} ms')
+    for field, floor in thresholds.get('min_accuracy', {}).items():
+        value = report['accuracy'].get(field)
+        if value is not None and value < floor:
+            failures.append(f'accuracy {field}: {value:.3f} < {floor}')
+    if baseline:
+        for stage, stats in report['summary'].items():
+            before = baseline.get('summary', {}).get(stage)
+            # Sub-millisecond stages are all noise
+            if before and before['p50_ms'] >= 1 and stats['p50_ms'] > before['p50_ms'] * max_regression:
+                failures.append(f'{stage}: p50 {stats["p50_ms"]:.1f} ms vs baseline {before["p50_ms"]:.1f} ms')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sheets', type=int, default=4, help='sheets per resolution and noise level')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.5, 1.0, 2.0])
+    parser.add_argument('--noise', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--formats', nargs='+', default=['png', 'jpg'])
+    parser.add_argument('--no-ocr', action='store_true', help='skip OCR even if tesseract is available')
+    parser.add_argument('--out', default='bench_output.json')
+    parser.add_argument('--thresholds', default=os.path.join(HERE, 'thresholds.json'))
+    parser.add_argument('--baseline', help='earlier --out file to compare against')
+    parser.add_argument('--max-regression', type=float, default=1.25)
+    args = parser.parse_args()
+
+    use_ocr = not args.no_ocr and ocr_available()
+    if not use_ocr:
+        os.environ['OCR_ENGINE'] = 'stub'
+        # The stub returns the whole page's words for every read, so the page must be read
+        # once: region crops or tile strips would repeat the words at each crop's offset
+        app.PIPELINE_CONFIG['text_regions'] = False
+        app.PIPELINE_CONFIG['tile_pixels'] = sys.maxsize
+    cases = []
+    for scale in args.scales:
+        for noise in args.noise:
+            for seed in range(args.sheets):
+                image, truth, drawn = generate_sheet(seed=seed, scale=scale, noise=noise)
+                for fmt in args.formats:
+                    ok, encoded = cv2.imencode('.' + fmt, image)
+                    timings, result, route = run_case(encoded.tobytes(), drawn, use_ocr)
+                    cases.append({
+                        'seed': seed, 'scale': scale, 'noise': noise, 'format': fmt, 'route': route,
+                        'bytes': len(encoded), 'timings_ms': timings,
+                        'accuracy': score_result(result, truth),
+                    })
+
+    summary, accuracy = summarize(cases)
+    routes = {}
+    for case in cases:
+        routes.setdefault(case['route'] or 'off', []).append(case['accuracy']['marks_f1'])
+    routes = {route: {'pages': len(f1), 'marks_f1': sum(f1) / len(f1)} for route, f1 in routes.items()}
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'ocr': app.ocr_engine.get_engine().name if use_ocr else 'skipped',
+        },
+        'pipeline_config': app.PIPELINE_CONFIG,
+        'summary': summary,
+        'accuracy': accuracy,
+        'routes': routes,
+        'cases': cases,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'{len(cases)} cases, OCR: {report["environment"]["ocr"]}')
+    for stage, stats in summary.items():
+        print(f'  {stage:10s} p50 {stats["p50_ms"]:9.2f} ms   p95 {stats["p95_ms"]:9.2f} ms')
+    for field, value in accuracy.items():
+        print(f'  accuracy {field:16s} {value:.3f}')
+    for route, stats in routes.items():
+        print(f'  route {route:6s} {stats["pages"]:4d} pages   marks_f1 {stats["marks_f1"]:.3f}')
+
+    thresholds = {}
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    if not use_ocr:
+        # Accuracy on the drawn words only measures the parser, not the pipeline
+        thresholds.pop('min_accuracy', None)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failures = check(report, thresholds, baseline, args.max_regression)
+    for failure in failures:
+        print(f'FAIL {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Synthetic BCSEA-style result sheets with known ground truth.
+
+Sheets are drawn with OpenCV's built-in Hershey fonts, so generating them needs no
+font files or network access. Each sheet comes with the expected clean_result_data
+output and an image_to_data-shaped dict of the words as drawn, which lets the parse
+and clean stages be measured on machines without tesseract.
+"""
+import random
+
+import cv2
+import numpy as np
+
+from parsing import DIGIT_WORD_MAP, KNOWN_SUBJECT_KEYWORDS
+
+BASE_WIDTH, BASE_HEIGHT = 2036, 1460
+FONT = cv2.FONT_HERSHEY_DUPLEX
+DIGIT_WORDS = {digit: word for word, digit in DIGIT_WORD_MAP.items()}
+
+FIRST_NAMES = ['Pravaat', 'Karma', 'Sonam', 'Pema', 'Tshering', 'Dorji', 'Kinley', 'Ugyen', 'Yeshi', 'Tandin']
+LAST_NAMES = ['Chhetri', 'Wangchuk', 'Dema', 'Lhamo', 'Tamang', 'Gurung', 'Zangmo', 'Penjor', 'Rai', 'Norbu']
+
+# (noise sigma, blur kernel, rotation degrees, lighting falloff)
+NOISE_LEVELS = {
+    0: (0, 0, 0.0, 0.0),
+    1: (10, 3, 0.5, 0.15),
+    2: (22, 5, 1.5, 0.35),
+}
+
+
+def mark_in_words(mark):
+    return ' '.join(DIGIT_WORDS[d] for d in str(mark))
+
+
+class SheetCanvas:
+    def __init__(self, scale):
+        self.scale = scale
+        self.image = np.full((int(BASE_HEIGHT * scale), int(BASE_WIDTH * scale), 3), 248, np.uint8)
+        self.font_scale = 1.15 * scale
+        self.thickness = max(1, int(round(2 * scale)))
+        self.words = {column: [] for column in ['level', 'page_num', 'block_num', 'par_num', 'line_num',
+                                                'word_num', 'left', 'top', 'width', 'height', 'conf', 'text']}
+
+    def line(self, text, x, y, block, line):
+        # x, y in base-sheet coordinates; y is the text baseline
+        x, y = int(x * self.scale), int(y * self.scale)
+        space = cv2.getTextSize(' ', FONT, self.font_scale, self.thickness)[0][0]
+        for n, word in enumerate(text.split()):
+            (w, h), baseline = cv2.getTextSize(word, FONT, self.font_scale, self.thickness)
+            cv2.putText(self.image, word, (x, y), FONT, self.font_scale, (20, 20, 20), self.thickness, cv2.LINE_AA)
+            row = [5, 1, block, 1, line, n + 1, x, y - h, w, h + baseline, 95, word]
+            for column, value in zip(self.words, row):
+                self.words[column].append(value)
+            x += w + space * 2
+
+
+def generate_sheet(seed=0, scale=1.0, noise=0, subjects=5):
+    """Returns (BGR image, expected clean_result_data output, drawn words as image_to_data dict)."""
+    rng = random.Random(seed)
+    canvas = SheetCanvas(scale)
+
+    name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+    chosen = rng.sample(KNOWN_SUBJECT_KEYWORDS, subjects)
+    marks = [rng.randint(35, 99) for _ in chosen]
+
+    cv2.rectangle(canvas.image, (int(20 * scale), int(20 * scale)),
+                  (int((BASE_WIDTH - 20) * scale), int((BASE_HEIGHT - 20) * scale)), (40, 40, 40), canvas.thickness)
+    canvas.line('BHUTAN COUNCIL FOR SCHOOL EXAMINATIONS AND ASSESSMENT', 420, 130, 1, 1)
+    canvas.line('BHUTAN HIGHER SECONDARY EDUCATION CERTIFICATE', 480, 230, 1, 2)
+    canvas.line('STATEMENT OF MARKS 2019', 780, 360, 1, 3)
+    canvas.line(f'Name {name.upper()}', 70, 430, 2, 1)
+    canvas.line(f'Index No. 0121{rng.randint(10000000, 99999999)}', 70, 500, 2, 2)
+    canvas.line('SUBJECTS', 160, 620, 3, 1)
+    canvas.line('Percentage Marks', 1090, 660, 4, 1)
+    for i, (subject, mark) in enumerate(zip(chosen, marks)):
+        y = 740 + i * 40
+        canvas.line(subject, 200, y, 5, i + 1)
+        style = rng.choice(['both', 'both', 'digits', 'words'])
+        if style == 'both':
+            canvas.line(f'{mark} {mark_in_words(mark)}', 1200, y, 6, i + 1)
+        elif style == 'digits':
+            canvas.line(str(mark), 1200, y, 6, i + 1)
+        else:
+            canvas.line(mark_in_words(mark), 1300, y, 6, i + 1)
+    canvas.line('RESULT PASS CERTIFICATE AWARDED', 60, 1190, 7, 1)
+    canvas.line('NOTE The pass mark for each subject is 40%', 60, 1250, 7, 2)
+
+    image = add_noise(canvas.image, noise, rng)
+    truth = {
+        'name': name,
+        'subjects': [{'subject': s.title(), 'marks': m} for s, m in zip(chosen, marks)]
+    }
+    return image, truth, canvas.words
+
+
+def add_noise(image, level, rng):
+    sigma, blur, angle, falloff = NOISE_LEVELS[level]
+    if not sigma:
+        return image
+    height, width = image.shape[:2]
+    if angle:
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-angle, angle), 1.0)
+        image = cv2.warpAffine(image, matrix, (width, height), borderValue=(248, 248, 248))
+    if falloff:
+        # Phone-photo lighting: darker towards one corner
+        gradient = np.linspace(1.0, 1.0 - falloff, width, dtype=np.float32)[None, :, None]
+        image = (image.astype(np.float32) * gradient).astype(np.uint8)
+    if blur:
+        image = cv2.GaussianBlur(image, (blur, blur), 0)
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, sigma, image.shape)
+    return np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+
+def score_result(result, truth):
+    """Field-level accuracy of one extraction against its ground truth."""
+    expected = {(s['subject'], s['marks']) for s in truth['subjects']}
+    found = {(s['subject'], s['marks']) for s in result.get('subjects', [])}
+    correct = len(expected & found)
+    precision = correct / len(found) if found else 0.0
+    recall = correct / len(expected) if expected else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    name_ok = (result.get('name') or '').lower() == truth['name'].lower()
+    return {
+        'name': 1.0 if name_ok else 0.0,
+        'marks_precision': precision,
+        'marks_recall': recall,
+        'marks_f1': f1,
+    }
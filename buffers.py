@@ -0,0 +1,66 @@
+import threading
+from contextlib import contextmanager
+
+
+class BufferPool:
+    """Scratch arrays reused across extractions through OpenCV's dst= parameters.
+
+    An extraction leases one set of named buffers for its duration and hands it back to
+    a shared free list afterwards. Each buffer grows to the largest image its set has
+    seen and is then handed out again as a view of the requested shape, so steady-state
+    extraction allocates no new page-sized arrays. Only `max_sets` sets are kept (one per
+    OCR slot is enough, since extractions run inside a slot), so the memory held depends
+    on OCR concurrency, not on how many threads the server runs. Requests above
+    max_bytes, or made outside a lease, get a plain allocation instead.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_sets=1):
+        self.max_bytes = max_bytes
+        self.max_sets = max_sets
+        self._free = []
+        self._leased = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def lease(self):
+        if getattr(self._local, 'buffers', None) is not None:
+            yield
+            return
+        with self._lock:
+            buffers = self._free.pop() if self._free else {}
+            self._leased[id(buffers)] = buffers
+        self._local.buffers = buffers
+        try:
+            yield
+        finally:
+            self._local.buffers = None
+            with self._lock:
+                del self._leased[id(buffers)]
+                if len(self._free) < self.max_sets:
+                    self._free.append(buffers)
+
+    def get(self, name, shape, dtype='uint8'):
+        # numpy is imported here rather than at the top: the app builds its pool at import
+        # time, before the OCR stack (and numpy with it) is loaded
+        import numpy as np
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None or size > self.max_bytes:
+            return np.empty(shape, dtype)
+        backing = buffers.get(name)
+        if backing is None or backing.nbytes < size:
+            backing = buffers[name] = np.empty(size, np.uint8)
+        return backing[:size].view(dtype).reshape(shape)
+
+    def held_bytes(self):
+        """Bytes in sets on the free list and in sets leased by running extractions."""
+        with self._lock:
+            free, leased = list(self._free), list(self._leased.values())
+        return {'free': _nbytes(free), 'leased': _nbytes(leased)}
+
+
+def _nbytes(sets):
+    # list() copies each dict first: a leased set can gain a buffer while this runs
+    return sum(array.nbytes for buffers in sets for array in list(buffers.values()))
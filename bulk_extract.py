@@ -0,0 +1,219 @@
+"""Extract results from a directory (or list) of scans without the web app.
+
+    python bulk_extract.py SCANS_DIR [MORE ...] --out results.jsonl
+    python bulk_extract.py --list files.txt --out results.csv --workers 8
+
+Images and PDFs (one record per page) are processed by a pool of worker processes
+and each record is appended to --out as soon as it finishes. Every finished item is
+also appended to a checkpoint file (default: OUT.checkpoint); running the same
+command again skips whatever the checkpoint already lists, so an interrupted run
+picks up where it stopped. Progress, throughput and ETA go to stderr.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import app
+
+CSV_FIELDS = ['file', 'page', 'name', 'index_number', 'subjects', 'error', 'seconds']
+
+
+def extract_file(path, page_index=None):
+    start = time.perf_counter()
+    try:
+        if page_index is None:
+            with open(path, 'rb') as f:
+                data = app.extract_data_from_bytes(f.read())
+        else:
+            data = app.extract_pdf_page(path, page_index)
+    except Exception as e:
+        data = {'error': str(e)}
+    data['seconds'] = round(time.perf_counter() - start, 3)
+    return data
+
+
+def find_inputs(paths, list_file):
+    if list_file:
+        with (sys.stdin if list_file == '-' else open(list_file)) as f:
+            paths = list(paths) + [line.strip() for line in f if line.strip()]
+    extensions = app.BATCH_IMAGE_EXTENSIONS | {'.pdf'}
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in extensions:
+                    yield os.path.join(root, name)
+
+
+def expand_tasks(paths):
+    # (checkpoint id, path, page index, error); PDFs become one task per page
+    for path in paths:
+        if not path.lower().endswith('.pdf'):
+            yield path, path, None, None
+            continue
+        try:
+            pages = app.pdf_pages.page_count(path)
+        except Exception as e:
+            yield path, path, None, f'Could not read PDF file: {e}'
+            continue
+        for page_index in range(pages):
+            yield f'{path}#{page_index + 1}', path, page_index, None
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.endswith('\n')}
+
+
+def trim_partial_line(path):
+    # A crash mid-write leaves half a record at the end; drop it, it is not checkpointed
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+class RecordWriter:
+    def __init__(self, path, fmt):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.csv = None
+        if fmt == 'csv':
+            fields = CSV_FIELDS
+            if not new_file:
+                # Resuming: keep the columns the file was started with
+                with open(path, newline='', encoding='utf-8') as existing:
+                    fields = next(csv.reader(existing), None) or CSV_FIELDS
+            self.csv = csv.DictWriter(self.file, fields, extrasaction='ignore')
+            if new_file:
+                self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv:
+            row = dict(record, subjects='; '.join(f'{s["subject"]}={s["marks"]}'
+                                                  for s in record.get('subjects', [])))
+            self.csv.writerow(row)
+        else:
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def make_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=app.batch_mp_context(),
+                               initializer=app._init_batch_worker)
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='image/PDF files or directories to walk')
+    parser.add_argument('--list', help='file with one path per line (- for stdin)')
+    parser.add_argument('--out', required=True, help='.jsonl or .csv output, appended to')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='default: from the --out extension')
+    parser.add_argument('--checkpoint', help='default: OUT.checkpoint')
+    parser.add_argument('--workers', type=int, default=app.app.config['BATCH_WORKERS'])
+    args = parser.parse_args()
+    if not args.paths and not args.list:
+        parser.error('give at least one path or --list')
+
+    fmt = args.format or ('csv' if args.out.lower().endswith('.csv') else 'jsonl')
+    checkpoint_path = args.checkpoint or args.out + '.checkpoint'
+    done = load_checkpoint(checkpoint_path)
+    trim_partial_line(args.out)
+
+    tasks = [task for task in expand_tasks(find_inputs(args.paths, args.list)) if task[0] not in done]
+    total = len(tasks)
+    print(f'{total} to extract, {len(done)} already done', file=sys.stderr)
+
+    writer = RecordWriter(args.out, fmt)
+    checkpoint = open(checkpoint_path, 'a', encoding='utf-8')
+    pool = make_pool(args.workers)
+    pending = {}
+    queue = iter(tasks)
+    finished = errors = 0
+    start = last_report = time.perf_counter()
+    try:
+        while True:
+            # Keep a couple of tasks per worker queued rather than submitting everything up front
+            while len(pending) < args.workers * 2:
+                task = next(queue, None)
+                if task is None:
+                    break
+                item_id, path, page_index, error = task
+                if error:
+                    writer.write({'file': path, 'error': error})
+                    checkpoint.write(item_id + '\n')
+                    checkpoint.flush()
+                    finished += 1
+                    errors += 1
+                    continue
+                pending[pool.submit(extract_file, path, page_index)] = (task, pool)
+            if not pending:
+                break
+
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                (item_id, path, page_index, _), task_pool = pending.pop(future)
+                try:
+                    data = future.result()
+                except Exception as e:
+                    # A worker died: replace the pool once, and write neither a record nor a
+                    # checkpoint entry, so the next run retries the item without duplicating it
+                    print(f'\n{item_id}: {e or "OCR worker crashed"}; rerun to retry it', file=sys.stderr)
+                    if task_pool is pool:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = make_pool(args.workers)
+                    finished += 1
+                    errors += 1
+                    continue
+                record = {'file': path}
+                if page_index is not None:
+                    record['page'] = page_index + 1
+                record.update(data)
+                writer.write(record)
+                # Checkpoint only after the record is on its way to disk
+                checkpoint.write(item_id + '\n')
+                checkpoint.flush()
+                finished += 1
+                errors += 'error' in data
+
+            now = time.perf_counter()
+            if now - last_report >= 1 or not pending:
+                last_report = now
+                rate = finished / (now - start)
+                eta = format_eta((total - finished) / rate) if rate else '?'
+                print(f'\r{finished}/{total}  {rate:.2f}/s  errors {errors}  ETA {eta}  ',
+                      end='', file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        print('\ninterrupted; rerun the same command to resume', file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        sys.exit(130)
+    finally:
+        writer.close()
+        checkpoint.close()
+    pool.shutdown()
+    elapsed = time.perf_counter() - start
+    print(f'\n{finished} extracted in {elapsed:.1f}s, {errors} errors', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
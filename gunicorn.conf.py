@@ -0,0 +1,18 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# One process: the job queue, caches and OCR admission limiter are all in-process.
+# Threads only wait on I/O and OCR slots; OCR_SLOTS bounds the CPU-heavy work.
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+timeout = 120
+graceful_timeout = 30
+
+
+def post_worker_init(worker):
+    # The app module is already imported by now; load the OCR stack in the background
+    # so the worker takes requests (and answers /healthz) straight away
+    import app
+    app.start_warm_up()
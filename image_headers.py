@@ -0,0 +1,119 @@
+import struct
+
+# SOFn markers carry the frame size; C4, C8 and CC share the range but are not frames
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_frame_scan(data, offset=2):
+    """Walks JPEG segments by their length fields from `offset`, a marker position.
+
+    Returns ((width, height), offset) at the frame header, (None, offset) with the
+    offset of the first marker not fully in `data`, or (None, None) if the stream is
+    not a sequence of segments. Resuming from that offset lets a caller find the frame
+    header behind any amount of metadata while only buffering a few bytes.
+    """
+    length = len(data)
+    while offset + 4 <= length:
+        if data[offset] != 0xFF:
+            return None, None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        segment_length, = struct.unpack_from('>H', data, offset + 2)
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > length:
+                return None, offset
+            height, width = struct.unpack_from('>HH', data, offset + 5)
+            return (width, height), offset
+        offset += 2 + segment_length
+    return None, offset
+
+
+def _jpeg_size(data):
+    return jpeg_frame_scan(data)[0]
+
+
+def _tiff_size(data):
+    # Width and height tags of the first IFD, which is the image OpenCV decodes
+    order = '<' if bytes(data[:2]) == b'II' else '>'
+    if len(data) < 8:
+        return None
+    offset, = struct.unpack_from(order + 'I', data, 4)
+    if offset + 2 > len(data):
+        return None
+    count, = struct.unpack_from(order + 'H', data, offset)
+    if offset + 2 + 12 * count > len(data):
+        return None
+    size = {}
+    for entry in range(offset + 2, offset + 2 + 12 * count, 12):
+        tag, kind = struct.unpack_from(order + 'HH', data, entry)
+        if tag in (256, 257):
+            # SHORT or LONG, left-aligned in the value field
+            value, = struct.unpack_from(order + ('H' if kind == 3 else 'I'), data, entry + 8)
+            size[tag] = value
+    if 256 not in size or 257 not in size:
+        return None
+    return size[256], size[257]
+
+
+def _webp_size(data):
+    chunk = bytes(data[12:16])
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack_from('<HH', data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits, = struct.unpack_from('<I', data, 21)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        width = int.from_bytes(bytes(data[24:27]), 'little') + 1
+        height = int.from_bytes(bytes(data[27:30]), 'little') + 1
+        return width, height
+    return None
+
+
+def sniff_format(head):
+    """File type from its first bytes: one of the image formats, 'tiff', 'pdf' or 'zip', else None."""
+    head = bytes(head[:16])
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head.startswith(b'BM'):
+        return 'bmp'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return 'zip'
+    return None
+
+
+def image_size(data):
+    """(format, width, height) read from the file header without decoding, or None."""
+    head = bytes(data[:32])
+    if head.startswith(b'\xff\xd8'):
+        size = _jpeg_size(data)
+        return ('jpeg',) + size if size else None
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and len(head) >= 24:
+        return ('png',) + struct.unpack_from('>II', head, 16)
+    if head[:6] in (b'GIF87a', b'GIF89a') and len(head) >= 10:
+        return ('gif',) + struct.unpack_from('<HH', head, 6)
+    if head.startswith(b'BM') and len(head) >= 26:
+        width, height = struct.unpack_from('<ii', head, 18)
+        return 'bmp', width, abs(height)
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        size = _webp_size(data)
+        return ('webp',) + size if size else None
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        size = _tiff_size(data)
+        return ('tiff',) + size if size else None
+    return None
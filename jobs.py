@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, payload, meta):
+        self.id = uuid.uuid4().hex
+        self.seq = None
+        self.payload = payload
+        self.meta = meta
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        job = {'job_id': self.id, 'status': self.status}
+        if self.status == 'done':
+            job['result'] = self.result
+        elif self.status == 'failed':
+            job['error'] = self.error
+        if self.started:
+            job['queued_seconds'] = self.started - self.created
+        if self.finished:
+            job['run_seconds'] = self.finished - self.started
+        return job
+
+
+class JobQueue:
+    """Bounded FIFO of jobs run by a fixed set of worker threads; finished jobs expire after ttl."""
+
+    def __init__(self, handler, workers=2, max_depth=32, ttl=600):
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._submitted = 0
+
+    def submit(self, payload, **meta):
+        self._start()
+        self._prune()
+        job = Job(payload, meta)
+        with self._lock:
+            self._submitted += 1
+            job.seq = self._submitted
+            self._jobs[job.id] = job
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                del self._jobs[job.id]
+                raise QueueFull()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def position(self, job):
+        """Queued jobs submitted before `job`, or None once it has started."""
+        with self._lock:
+            if job.status != 'queued':
+                return None
+            return sum(1 for other in self._jobs.values() if other.status == 'queued' and other.seq < job.seq)
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.started = time.time()
+            try:
+                job.result = self.handler(job.payload)
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e) or e.__class__.__name__
+                job.status = 'failed'
+            finally:
+                job.payload = None
+                job.finished = time.time()
+                job.done.set()
+                self._queue.task_done()
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,155 @@
+"""Exact and OCR-error-tolerant lookup of words against a fixed vocabulary.
+
+Exact hits come from one compiled alternation regex, so each token is scanned once
+however long the vocabulary is. Near misses ("MATHEMATlCS", "SEVFN") go through a
+SymSpell-style index: every vocabulary word is stored under all the strings left by
+deleting up to two of its letters, so a lookup only generates the deletes of the
+query and checks the few candidates that share one, instead of computing an edit
+distance against the whole vocabulary.
+
+Digits inside a token are read as the letter they resemble ("0NE", "MATHEMAT1CS").
+A vocabulary of short, common-looking words (the digit words) can instead be given
+`confusions`: then a near miss must be the same length and differ only by swapping
+glyphs OCR mixes up, so ordinary English words ("THERE", "GIVE", "NIGHT") never
+pass for "THREE", "FIVE" or "EIGHT". Keywords of several words match across
+consecutive tokens.
+"""
+import re
+from functools import lru_cache
+from itertools import combinations
+
+NON_LETTERS = re.compile('[^A-Z]')
+DIGIT_LETTERS = str.maketrans('012568', 'OIZSGB')
+# Glyph groups OCR commonly reads as one another, once digits are mapped to letters
+OCR_CONFUSIONS = ('OQD', 'IL', 'EF')
+
+
+def _deletes(word, max_distance):
+    found = {word}
+    for distance in range(1, min(max_distance, len(word) - 1) + 1):
+        for positions in combinations(range(len(word)), distance):
+            found.add(''.join(c for i, c in enumerate(word) if i not in positions))
+    return found
+
+
+def edit_distance(a, b):
+    # Optimal string alignment: insertions, deletions, substitutions and adjacent swaps
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def letters(token):
+    return NON_LETTERS.sub('', token.upper().translate(DIGIT_LETTERS))
+
+
+def allowed_distance(word):
+    # Short words only tolerate a single error; nothing under 4 letters is fuzzy-matched
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 9 else 2
+
+
+class KeywordMatcher:
+    def __init__(self, vocabulary, cache_size=4096, confusions=None):
+        self.vocabulary = sorted({word.upper() for word in vocabulary})
+        # Longest first so a keyword that contains another wins the alternation
+        alternatives = sorted(self.vocabulary, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(map(re.escape, alternatives))) if alternatives else None
+        self._exact = set(self.vocabulary)
+        # Keywords by their letters alone, so "COMPUTER APPLICATIONS" is found however it was split
+        self._keys = {letters(word): word for word in self.vocabulary}
+        self._max_words = max((len(word.split()) for word in self.vocabulary), default=1)
+        self._confusable = None
+        self._index = {}
+        if confusions is not None:
+            self._confusable = {(a, b) for group in confusions for a in group for b in group if a != b}
+        else:
+            for key in self._keys:
+                for deleted in _deletes(key, allowed_distance(key)):
+                    self._index.setdefault(deleted, set()).add(key)
+        # Result sheets repeat the same few hundred tokens, so lookups are memoized per token
+        self._fuzzy = lru_cache(maxsize=cache_size)(self._fuzzy_lookup)
+        self._match = lru_cache(maxsize=cache_size)(self._match_token)
+        self._scan = lru_cache(maxsize=cache_size)(self._scan_token)
+
+    def _fuzzy_lookup(self, key):
+        if key in self._keys:
+            return self._keys[key]
+        if self._confusable is not None:
+            return self._confusion_lookup(key)
+        limit = allowed_distance(key)
+        if not limit:
+            return None
+        candidates = set()
+        for deleted in _deletes(key, limit):
+            candidates |= self._index.get(deleted, set())
+        best, best_distance, tied = None, None, False
+        for candidate in candidates:
+            distance = edit_distance(key, candidate)
+            if distance > min(limit, allowed_distance(candidate)):
+                continue
+            if best_distance is None or distance < best_distance:
+                best, best_distance, tied = candidate, distance, False
+            elif distance == best_distance:
+                tied = True
+        # Equally close to two keywords is a guess, not a match
+        return None if tied or best is None else self._keys[best]
+
+    def _confusion_lookup(self, key):
+        limit = max(1, allowed_distance(key))
+        found = []
+        for candidate, word in self._keys.items():
+            if len(candidate) != len(key):
+                continue
+            swaps = [(a, b) for a, b in zip(key, candidate) if a != b]
+            if len(swaps) <= limit and all(pair in self._confusable for pair in swaps):
+                found.append(word)
+        return found[0] if len(found) == 1 else None
+
+    def _match_token(self, token):
+        upper = token.upper()
+        if upper in self._exact:
+            return upper
+        return self._fuzzy(letters(upper))
+
+    def _scan_token(self, token):
+        upper = token.upper()
+        hits = self._pattern.findall(upper) if self._pattern else []
+        if hits:
+            return tuple(hits)
+        word = self._fuzzy(letters(upper))
+        return (word,) if word else ()
+
+    def match(self, token):
+        """The vocabulary word `token` reads as, exactly or within OCR error, else None."""
+        return self._match(token)
+
+    def locate(self, tokens):
+        """(start, stop, word) for each vocabulary word found in a line of tokens."""
+        tokens = list(tokens)
+        found = []
+        i = 0
+        while i < len(tokens):
+            # A multi-word keyword over the next few tokens wins over single-token hits
+            for size in range(min(self._max_words, len(tokens) - i), 1, -1):
+                word = self._fuzzy(letters(''.join(tokens[i:i + size])))
+                if word and ' ' in word:
+                    found.append((i, i + size, word))
+                    i += size
+                    break
+            else:
+                found.extend((i, i + 1, word) for word in self._scan(tokens[i]))
+                i += 1
+        return found
+
+    def find_all(self, tokens):
+        """Vocabulary words in a line: exact substrings of each token, else a fuzzy whole-token match."""
+        return [word for _, _, word in self.locate(tokens)]
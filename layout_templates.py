@@ -0,0 +1,235 @@
+"""Layout templates for fixed-format result sheets.
+
+A template is learned once from a reference sheet: ORB keypoints of the page and
+the boxes where the name, index number and subject rows sit. An upload is matched
+against every template with the same ORB features, warped into the best match's
+frame with a RANSAC similarity transform, and only the field boxes are OCR'd as
+single lines. Uploads that match nothing go through the full-page path.
+
+    python layout_templates.py learn reference.jpg --name bhsec-2019 [--dir layouts]
+    python layout_templates.py match upload.jpg [--dir layouts]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import cv2
+import numpy as np
+
+import ocr_engine
+from parsing import (SUBJECT_MATCHER, build_line_index, find_index_number, find_mark, mean_conf,
+                     parse_ocr_data)
+
+logger = logging.getLogger(__name__)
+
+MATCH_LONG_SIDE = 1000
+ORB_FEATURES = 1500
+RATIO = 0.75
+# Subject rows beyond the reference's last one, for students with more subjects
+EXTRA_ROWS = 2
+
+
+def _features(gray):
+    # ORB on a fixed-size copy so matching costs the same for any scan resolution;
+    # keypoints are returned in the coordinates of `gray`
+    scale = MATCH_LONG_SIDE / float(max(gray.shape[:2]))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    keypoints, descriptors = cv2.ORB_create(ORB_FEATURES).detectAndCompute(small, None)
+    points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2) / scale
+    return points, descriptors
+
+
+def _line_box(words, label_index, page_width, slack=0.4):
+    # From the end of the label to the end of the line's value, with room for longer values
+    label = words[label_index]
+    line = [w for w in words if w.line == label.line and w.left > label.left]
+    value_right = max([w.left + w.width for w in line] + [label.left + label.width])
+    left = label.left + label.width
+    right = min(page_width, value_right + int((value_right - left) * slack))
+    top = min(w.top for w in [label] + line)
+    bottom = max(w.top + w.height for w in [label] + line)
+    pad = max(2, (bottom - top) // 4)
+    return [left, top - pad, right - left, bottom - top + 2 * pad]
+
+
+def _label_position(words, label):
+    for i, word in enumerate(words):
+        if label in word.text.upper():
+            return i
+    return None
+
+
+def learn_fields(ocr_data, page_width):
+    """Field boxes from the OCR of a reference sheet (in that sheet's coordinates)."""
+    words, _ = build_line_index(ocr_data)
+    raw = parse_ocr_data(ocr_data)
+    fields = {}
+
+    name_at = _label_position(words, 'NAME')
+    if name_at is not None:
+        fields['name'] = _line_box(words, name_at, page_width)
+    index_at = _label_position(words, 'INDEX')
+    if index_at is not None:
+        _, number_words = find_index_number(words)
+        if number_words:
+            # Label is "Index No." - start the box after whatever precedes the number
+            label_at = words.index(number_words[0]) - 1
+            fields['index_number'] = _line_box(words, label_at, page_width)
+
+    rows = []
+    for subject in raw['subjects'] + raw.get('unread_subjects', []):
+        x, y, w, h = subject['row_box']
+        in_band = [word for word in words if y <= word.top + word.height / 2.0 <= y + h]
+        left = min(word.left for word in in_band)
+        rows.append([left, y, x + w - left, h])
+    rows.sort(key=lambda box: box[1])
+    if len(rows) >= 2:
+        pitch = (rows[-1][1] - rows[0][1]) / (len(rows) - 1)
+        last = rows[-1]
+        rows += [[last[0], int(last[1] + pitch * n), last[2], last[3]] for n in range(1, EXTRA_ROWS + 1)]
+    fields['rows'] = rows
+    return fields
+
+
+class LayoutTemplate:
+    def __init__(self, name, size, points, descriptors, fields):
+        self.name = name
+        self.size = tuple(size)
+        self.points = points
+        self.descriptors = descriptors
+        self.fields = fields
+
+    @classmethod
+    def learn(cls, name, gray, ocr_data):
+        points, descriptors = _features(gray)
+        fields = learn_fields(ocr_data, gray.shape[1])
+        return cls(name, (gray.shape[1], gray.shape[0]), points, descriptors, fields)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name + '.npz')
+        np.savez_compressed(path, size=np.int32(self.size), points=self.points,
+                            descriptors=self.descriptors, fields=np.array(json.dumps(self.fields)))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(os.path.splitext(os.path.basename(path))[0], data['size'].tolist(),
+                       data['points'], data['descriptors'], json.loads(str(data['fields'])))
+
+    def read_fields(self, binary):
+        """parse_ocr_data-shaped result from single-line reads of the field boxes of an aligned page."""
+        boxes = [self.fields[f] for f in ('name', 'index_number') if f in self.fields] + self.fields['rows']
+        reads = iter(ocr_engine.read_cells(binary, boxes))
+        result = {'name': None, 'name_confidence': None, 'index_number': None,
+                  'subjects': [], 'unread_subjects': []}
+
+        if 'name' in self.fields:
+            words, _ = build_line_index(next(reads))
+            parts = [w for w in words if w.text.isalpha()][:4]
+            result['name'] = ' '.join(w.text.title() for w in parts) or None
+            result['name_confidence'] = mean_conf(parts)
+        if 'index_number' in self.fields:
+            words, _ = build_line_index(next(reads))
+            digits = max((''.join(c for c in w.text if c.isdigit()) for w in words), key=len, default='')
+            result['index_number'] = digits if len(digits) >= 6 else None
+
+        for box, data in zip(self.fields['rows'], reads):
+            words, _ = build_line_index(data)
+            words.sort(key=lambda w: w.left)
+            # Keyword spans rather than single words, so a multi-word subject is found as well
+            spans = SUBJECT_MATCHER.locate([w.text for w in words])
+            if not spans:
+                continue
+            subject = ' '.join(sorted({keyword for _, _, keyword in spans}))
+            subject_name = ' '.join(sorted(set(subject.title().split())))
+            if any(s['subject'] == subject_name for s in result['subjects'] + result['unread_subjects']):
+                continue
+            mark, mark_words = find_mark(words)
+            mark_left = max(w.left + w.width for start, stop, _ in spans for w in words[start:stop])
+            row_box = [mark_left, box[1], box[0] + box[2] - mark_left, box[3]]
+            if mark:
+                result['subjects'].append({'subject': subject_name, 'marks': mark,
+                                           'confidence': mean_conf(mark_words), 'row_box': row_box})
+            else:
+                result['unread_subjects'].append({'subject': subject_name, 'row_box': row_box})
+        return result
+
+
+class TemplateLibrary:
+    def __init__(self, directory, min_inliers=40):
+        self.directory = directory
+        self.min_inliers = min_inliers
+        self.templates = []
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith('.npz'):
+                    self.templates.append(LayoutTemplate.load(os.path.join(directory, filename)))
+        self._matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def register(self, gray):
+        """(template, page warped into its frame, inliers) for the best match, else None."""
+        if not self.templates:
+            return None
+        points, descriptors = _features(gray)
+        if descriptors is None or len(descriptors) < self.min_inliers:
+            return None
+
+        best = None
+        for template in self.templates:
+            pairs = self._matcher.knnMatch(descriptors, template.descriptors, k=2)
+            good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < RATIO * p[1].distance]
+            if len(good) < self.min_inliers:
+                continue
+            src = points[[m.queryIdx for m in good]]
+            dst = template.points[[m.trainIdx for m in good]]
+            threshold = 3.0 * max(template.size) / MATCH_LONG_SIDE
+            matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC,
+                                                          ransacReprojThreshold=threshold)
+            count = int(inliers.sum()) if inliers is not None else 0
+            if matrix is not None and count >= self.min_inliers and (best is None or count > best[2]):
+                best = (template, matrix, count)
+
+        if best is None:
+            return None
+        template, matrix, count = best
+        warped = cv2.warpAffine(gray, matrix, template.size, flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+        logger.info('matched layout %s with %d inliers', template.name, count)
+        return template, warped, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['learn', 'match'])
+    parser.add_argument('image')
+    parser.add_argument('--name', help='template name (learn)')
+    parser.add_argument('--dir', default=os.environ.get('LAYOUT_TEMPLATE_DIR', 'layouts'))
+    args = parser.parse_args()
+
+    # Imported here: app imports this module
+    import app
+    import preprocess
+
+    with open(args.image, 'rb') as f:
+        gray = preprocess.decode_image(f.read(), app.PIPELINE_CONFIG['min_decode_long_side'])
+    if gray is None:
+        sys.exit(f'could not read {args.image}')
+    gray = preprocess.normalize_resolution(gray, app.PIPELINE_CONFIG['text_height'])
+
+    if args.command == 'learn':
+        if not args.name:
+            parser.error('learn needs --name')
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        template = LayoutTemplate.learn(args.name, gray, ocr_engine.image_to_data(binary))
+        print(f'{template.save(args.dir)}: {len(template.points)} keypoints, fields {json.dumps(template.fields)}')
+    else:
+        match = TemplateLibrary(args.dir).register(gray)
+        print(f'{match[0].name} ({match[2]} inliers)' if match else 'no template matched')
+
+
+if __name__ == '__main__':
+    main()
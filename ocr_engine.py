@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import pytesseract
+from pytesseract import Output
+
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PSM_SINGLE_LINE = 7
+
+TSV_COLUMNS = [
+    'level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+    'left', 'top', 'width', 'height', 'conf', 'text'
+]
+
+
+def tsv_to_dict(tsv):
+    # Same shape as pytesseract's Output.DICT, from libtesseract's header-less TSV
+    result = {column: [] for column in TSV_COLUMNS}
+    for row in tsv.splitlines():
+        cells = row.split('\t')
+        if len(cells) < len(TSV_COLUMNS) - 1:
+            continue
+        if len(cells) < len(TSV_COLUMNS):
+            cells.append('')
+        for column, cell in zip(TSV_COLUMNS[:-1], cells):
+            result[column].append(int(float(cell)))
+        result['text'].append(cells[-1])
+    return result
+
+
+class TesseractWorkerPool:
+    """Long-lived libtesseract instances, each loaded with traineddata once."""
+
+    def __init__(self, size, lang='eng'):
+        self.size = size
+        self._apis = queue.Queue()
+        for _ in range(size):
+            self._apis.put(tesserocr.PyTessBaseAPI(lang=lang))
+        self.default_psm = self._apis.queue[0].GetPageSegMode()
+
+    def image_to_data(self, image, psm=None, whitelist=None):
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        api = self._apis.get()
+        try:
+            if psm is not None:
+                api.SetPageSegMode(psm)
+            if whitelist:
+                api.SetVariable('tessedit_char_whitelist', whitelist)
+            api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+            api.Recognize()
+            return tsv_to_dict(api.GetTSVText(0))
+        finally:
+            # Instances are shared, so per-call settings must not leak into the next caller
+            api.Clear()
+            if psm is not None:
+                api.SetPageSegMode(self.default_psm)
+            if whitelist:
+                api.SetVariable('tessedit_char_whitelist', '')
+            self._apis.put(api)
+
+    def close(self):
+        while not self._apis.empty():
+            self._apis.get().End()
+
+
+class StubOcr:
+    """Canned image_to_data output, for load-testing everything around tesseract.
+
+    Page reads return the words in `data_path` (an image_to_data dict saved as JSON)
+    after an optional fixed delay. Single-line cell reads return no words, so the
+    second pass leaves the page's marks alone.
+    """
+
+    def __init__(self, data_path=None, seconds=0.0):
+        self.data = {column: [] for column in TSV_COLUMNS}
+        if data_path:
+            with open(data_path, encoding='utf-8') as f:
+                self.data = json.load(f)
+        self.seconds = seconds
+
+    def image_to_data(self, image, psm=None, whitelist=None):
+        if psm == PSM_SINGLE_LINE:
+            return {column: [] for column in TSV_COLUMNS}
+        if self.seconds:
+            time.sleep(self.seconds)
+        return {column: list(values) for column, values in self.data.items()}
+
+
+class OcrEngine:
+    def __init__(self, workers, lang='eng', stub=None):
+        self.lang = lang
+        self.pool = None
+        self.stub = stub
+        self.stats = {
+            name: {'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'last_seconds': None}
+            for name in ('tesserocr', 'pytesseract', 'stub')
+        }
+        self._stats_lock = threading.Lock()
+        if stub is None and TESSEROCR_AVAILABLE and workers > 0:
+            try:
+                self.pool = TesseractWorkerPool(workers, lang=lang)
+            except RuntimeError as e:
+                logger.warning('Could not start tesseract workers, using pytesseract: %s', e)
+
+    @property
+    def name(self):
+        if self.stub is not None:
+            return 'stub'
+        return 'tesserocr' if self.pool is not None else 'pytesseract'
+
+    def image_to_data(self, image, psm=None, whitelist=None):
+        if self.stub is not None:
+            start = time.perf_counter()
+            data = self.stub.image_to_data(image, psm=psm, whitelist=whitelist)
+            self._record('stub', time.perf_counter() - start)
+            return data
+
+        if self.pool is not None:
+            start = time.perf_counter()
+            try:
+                data = self.pool.image_to_data(image, psm=psm, whitelist=whitelist)
+            except RuntimeError as e:
+                self._record('tesserocr', time.perf_counter() - start, error=True)
+                logger.warning('tesserocr call failed, retrying with pytesseract: %s', e)
+            else:
+                self._record('tesserocr', time.perf_counter() - start)
+                return data
+
+        config = []
+        if psm is not None:
+            config.append(f'--psm {psm}')
+        if whitelist:
+            config.append(f'-c tessedit_char_whitelist={whitelist}')
+        start = time.perf_counter()
+        try:
+            data = pytesseract.image_to_data(image, lang=self.lang, config=' '.join(config),
+                                             output_type=Output.DICT)
+        except Exception:
+            self._record('pytesseract', time.perf_counter() - start, error=True)
+            raise
+        self._record('pytesseract', time.perf_counter() - start)
+        return data
+
+    def _record(self, path, seconds, error=False):
+        with self._stats_lock:
+            stats = self.stats[path]
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['total_seconds'] += seconds
+            stats['last_seconds'] = seconds
+        logger.debug('%s image_to_data took %.1f ms', path, seconds * 1000)
+
+    def snapshot(self):
+        with self._stats_lock:
+            report = {'engine': self.name, 'workers': self.pool.size if self.pool else 0}
+            for path, stats in self.stats.items():
+                mean = stats['total_seconds'] / stats['calls'] if stats['calls'] else None
+                report[path] = dict(stats, mean_seconds=mean)
+            return report
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    # OCR_ENGINE: auto (tesserocr workers, else pytesseract), pytesseract, or stub
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            backend = os.environ.get('OCR_ENGINE', 'auto')
+            if backend not in ('auto', 'pytesseract', 'stub'):
+                raise ValueError(f'OCR_ENGINE must be auto, pytesseract or stub, not {backend!r}')
+            workers = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1)) if backend == 'auto' else 0
+            stub = None
+            if backend == 'stub':
+                stub = StubOcr(os.environ.get('OCR_STUB_DATA'), float(os.environ.get('OCR_STUB_SECONDS', 0)))
+            _engine = OcrEngine(workers, lang=os.environ.get('OCR_LANG', 'eng'), stub=stub)
+        return _engine
+
+
+def image_to_data(image, psm=None, whitelist=None):
+    return get_engine().image_to_data(image, psm=psm, whitelist=whitelist)
+
+
+def read_cells(image, boxes, whitelist=None, psm=PSM_SINGLE_LINE, border=10, threshold=None):
+    # Small (x, y, w, h) crops read one at a time, each with a white border since
+    # tesseract misses glyphs that touch the edge; coordinates come back in page space.
+    # With `threshold`, `image` is grayscale and only the crops are binarized.
+    height, width = image.shape[:2]
+    results = []
+    for x, y, w, h in boxes:
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(width, x + w), min(height, y + h)
+        if x1 <= x0 or y1 <= y0:
+            results.append({})
+            continue
+        crop = image[y0:y1, x0:x1]
+        if threshold is not None:
+            crop = np.where(crop > threshold, 255, 0).astype(np.uint8)
+        crop = np.pad(crop, border, constant_values=255)
+        data = get_engine().image_to_data(crop, psm=psm, whitelist=whitelist)
+        data['left'] = [v + x0 - border for v in data.get('left', [])]
+        data['top'] = [v + y0 - border for v in data.get('top', [])]
+        results.append(data)
+    return results
+
+
+def _merge(merged, data, x, y, block_offset, keep=None):
+    # Appends one crop's words in page coordinates; `keep` = (top, bottom) drops words
+    # whose vertical centre is outside that band. Returns the crop's highest block number.
+    rows = range(len(data.get('text', [])))
+    if keep is not None:
+        rows = [i for i in rows if keep[0] <= data['top'][i] + y + data['height'][i] / 2.0 < keep[1]]
+    for column in TSV_COLUMNS:
+        values = data.get(column, [])
+        values = [values[i] for i in rows]
+        if column == 'left':
+            values = [v + x for v in values]
+        elif column == 'top':
+            values = [v + y for v in values]
+        elif column == 'block_num':
+            values = [v + block_offset for v in values]
+        merged[column].extend(values)
+    return max(data.get('block_num', []), default=0)
+
+
+def image_to_data_regions(image, regions, psm=None):
+    # OCR each (x, y, w, h) crop and stitch the words back into page coordinates.
+    # Block numbers are offset per crop so lines from different crops never collide.
+    engine = get_engine()
+    merged = {column: [] for column in TSV_COLUMNS}
+    block_offset = 0
+    for x, y, w, h in regions:
+        data = engine.image_to_data(image[y:y + h, x:x + w], psm=psm)
+        block_offset += _merge(merged, data, x, y, block_offset)
+    return merged
+
+
+def image_to_data_tiles(tiles, psm=None):
+    # `tiles` yields (binary strip, top, keep_top, keep_bottom); it may reuse one buffer
+    # for every strip since each is OCR'd before the next is produced.
+    engine = get_engine()
+    merged = {column: [] for column in TSV_COLUMNS}
+    block_offset = 0
+    for strip, top, keep_top, keep_bottom in tiles:
+        data = engine.image_to_data(strip, psm=psm)
+        block_offset += _merge(merged, data, 0, top, block_offset, (keep_top, keep_bottom))
+    return merged
@@ -0,0 +1,206 @@
+import os
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from keyword_matcher import OCR_CONFUSIONS, KeywordMatcher
+
+DIGIT_WORD_MAP = {
+    'ZERO': '0', 'ONE': '1', 'TWO': '2', 'THREE': '3', 'FOUR': '4',
+    'FIVE': '5', 'SIX': '6', 'SEVEN': '7', 'EIGHT': '8', 'NINE': '9'
+}
+KNOWN_SUBJECT_KEYWORDS = [
+    'ENGLISH', 'DZONGKHA', 'HISTORY', 'CIVICS', 'GEOGRAPHY',
+    'MATHS', 'SCIENCE', 'COMPUTER', 'APPLICATIONS', 'PHYSICS', 'CHEMISTRY', 'MATHEMATICS'
+]
+
+# OCR_SUBJECT_KEYWORDS="ENGLISH,ECONOMICS,..." replaces the list without a code change
+SUBJECT_KEYWORDS = [kw.strip().upper() for kw in os.environ.get('OCR_SUBJECT_KEYWORDS', '').split(',')
+                    if kw.strip()] or KNOWN_SUBJECT_KEYWORDS
+
+SUBJECT_MATCHER = KeywordMatcher(SUBJECT_KEYWORDS)
+DIGIT_WORD_MATCHER = KeywordMatcher(DIGIT_WORD_MAP, confusions=OCR_CONFUSIONS)
+
+# Characters a marks cell can contain: digits and the letters of the digit words
+MARK_CHARACTERS = '0123456789' + ''.join(sorted(set(''.join(DIGIT_WORD_MAP))))
+MARK_RANGE = (30, 100)
+
+Word = namedtuple('Word', ['text', 'left', 'top', 'width', 'height', 'conf', 'line'])
+
+
+def words_to_number(words):
+    num_str = ''.join(DIGIT_WORD_MAP[d] for d in map(DIGIT_WORD_MATCHER.match, words) if d)
+    return int(num_str) if num_str else None
+
+
+def merge_subject_keywords(line_words):
+    subjects = SUBJECT_MATCHER.find_all(line_words)
+    return ' '.join(sorted(set(subjects))) if subjects else None
+
+
+def extract_digit_word_marks(words):
+    digit_words = [d for d in map(DIGIT_WORD_MATCHER.match, words) if d]
+    if len(digit_words) >= 2:
+        return words_to_number(digit_words[:3])
+    return None
+
+
+def build_line_index(data):
+    """One pass over image_to_data output: reading-order words and (block, par, line) -> words."""
+    words = []
+    lines = {}
+    texts = data.get('text', [])
+    for i in range(len(texts)):
+        text = str(texts[i]).strip()
+        if not text or float(data['conf'][i]) <= 0:
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        word = Word(text, data['left'][i], data['top'][i], data['width'][i], data['height'][i],
+                    float(data['conf'][i]), key)
+        words.append(word)
+        lines.setdefault(key, []).append(word)
+    for line_words in lines.values():
+        line_words.sort(key=lambda w: w.left)
+    return words, lines
+
+
+def _row_finder(lines):
+    # Table columns come back as separate blocks; a subject's marks are the lines whose
+    # vertical centre falls inside the subject line's band.
+    centres = sorted(
+        (sum(w.top + w.height / 2.0 for w in line_words) / len(line_words), key)
+        for key, line_words in lines.items()
+    )
+    positions = [centre for centre, _ in centres]
+
+    def row_of(key):
+        line_words = lines[key]
+        top = min(w.top for w in line_words)
+        bottom = max(w.top + w.height for w in line_words)
+        found = centres[bisect_left(positions, top):bisect_right(positions, bottom)]
+        return [k for _, k in found if k != key]
+
+    return row_of
+
+
+def mean_conf(words):
+    return round(sum(w.conf for w in words) / len(words), 1) if words else None
+
+
+def find_name(words):
+    # Returns (name, words it was read from)
+    for i, word in enumerate(words):
+        if 'NAME' in word.text.upper():
+            parts = [w for w in words[i + 1:i + 5] if w.text.isalpha()]
+            return ' '.join(w.text.title() for w in parts), parts
+    return None, []
+
+
+def find_index_number(words):
+    # Returns (index number, words it was read from); BCSEA index numbers are 6+ digits
+    for i, word in enumerate(words):
+        if 'INDEX' in word.text.upper():
+            for w in words[i + 1:i + 5]:
+                digits = ''.join(c for c in w.text if c.isdigit())
+                if len(digits) >= 6:
+                    return digits, [w]
+    return None, []
+
+
+def find_mark(words):
+    # Returns (mark, words it was read from)
+    digit_words = [(w, d) for w, d in ((w, DIGIT_WORD_MATCHER.match(w.text)) for w in words) if d][:3]
+    if len(digit_words) >= 2:
+        word_based_mark = int(''.join(DIGIT_WORD_MAP[d] for _, d in digit_words))
+        if word_based_mark:
+            return word_based_mark, [w for w, _ in digit_words]
+    for w in words:
+        if w.text.isdigit() and MARK_RANGE[0] <= int(w.text) <= MARK_RANGE[1]:
+            return int(w.text), [w]
+    return None, []
+
+
+def _row_box(line_words, row_words, page_right):
+    # (x, y, w, h) of the part of a subject's row right of the subject name: where its marks are printed
+    subject_words = [w for start, stop, _ in SUBJECT_MATCHER.locate([w.text for w in line_words])
+                     for w in line_words[start:stop]] or line_words
+    top = min(w.top for w in row_words)
+    bottom = max(w.top + w.height for w in row_words)
+    pad = max(2, (bottom - top) // 4)
+    left = max(w.left + w.width for w in subject_words)
+    right = max([page_right] + [w.left + w.width for w in row_words])
+    return [left, top - pad, right - left, bottom - top + 2 * pad]
+
+
+def parse_ocr_data(data):
+    words, lines = build_line_index(data)
+    row_of = _row_finder(lines)
+
+    page_right = max((w.left + w.width for w in words), default=0)
+    extracted_subjects = []
+    unread_subjects = []
+    for key, line_words in lines.items():
+        subject = merge_subject_keywords([w.text for w in line_words])
+        if not subject:
+            continue
+        row_words = list(line_words)
+        for other in row_of(key):
+            row_words += lines[other]
+        row_words.sort(key=lambda w: w.left)
+        mark, mark_words = find_mark(row_words)
+        if not mark:
+            # Marks printed under the subject rather than beside it
+            block, par, line = key
+            mark, mark_words = find_mark(row_words + lines.get((block, par, line + 1), []))
+        subject_name = ' '.join(sorted(set(subject.title().split())))
+        row_box = _row_box(line_words, row_words, page_right)
+        if mark:
+            if not any(s['subject'] == subject_name for s in extracted_subjects):
+                extracted_subjects.append({
+                    'subject': subject_name,
+                    'marks': mark,
+                    'confidence': mean_conf(mark_words),
+                    'row_box': row_box
+                })
+        elif not any(s['subject'] == subject_name for s in unread_subjects):
+            unread_subjects.append({'subject': subject_name, 'row_box': row_box})
+
+    name, name_words = find_name(words)
+    index_number, _ = find_index_number(words)
+    return {
+        'name': name,
+        'name_confidence': mean_conf(name_words),
+        'index_number': index_number,
+        'subjects': extracted_subjects,
+        # Subjects whose row had no readable mark, kept so a second pass can look again
+        'unread_subjects': [s for s in unread_subjects
+                            if not any(e['subject'] == s['subject'] for e in extracted_subjects)]
+    }
+
+
+def reread_candidates(raw_result, min_conf):
+    """(subject, row box) for marks that are missing, out of range or read with low confidence."""
+    cells = [(s['subject'], s['row_box']) for s in raw_result.get('unread_subjects', [])]
+    for s in raw_result.get('subjects', []):
+        low, high = MARK_RANGE
+        if not low <= s['marks'] <= high or (s['confidence'] or 0) < min_conf:
+            cells.append((s['subject'], s['row_box']))
+    return cells
+
+
+def apply_reread(raw_result, subject, data):
+    # Takes the second read of a marks cell when it yields an in-range mark; returns whether it did
+    words, _ = build_line_index(data)
+    words.sort(key=lambda w: w.left)
+    mark, mark_words = find_mark(words)
+    if mark is None or not MARK_RANGE[0] <= mark <= MARK_RANGE[1]:
+        return False
+    for entry in raw_result['subjects']:
+        if entry['subject'] == subject:
+            entry.update(marks=mark, confidence=mean_conf(mark_words))
+            return True
+    unread = next(s for s in raw_result['unread_subjects'] if s['subject'] == subject)
+    raw_result['unread_subjects'].remove(unread)
+    raw_result['subjects'].append({'subject': subject, 'marks': mark, 'confidence': mean_conf(mark_words),
+                                   'row_box': unread['row_box']})
+    raw_result['subjects'].sort(key=lambda s: s['row_box'][1])
+    return True
@@ -0,0 +1,44 @@
+"""Lazy rasterization of PDF pages for OCR.
+
+Pages are rendered one at a time, in whichever process needs them, straight to an
+8-bit grayscale array at OCR resolution; a multi-page PDF is never held as a list
+of page images. The document is opened per page and closed straight after, since a
+worker cannot tell which of a PDF's pages is its last, and a cached handle would keep
+the request's deleted temp file open on disk.
+"""
+import os
+
+import numpy as np
+
+try:
+    import pymupdf
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+PDF_DPI = int(os.environ.get('PDF_DPI', 300))
+MAX_PDF_PAGES = int(os.environ.get('MAX_PDF_PAGES', 50))
+
+
+def is_pdf(data):
+    return data[:5] == b'%PDF-'
+
+
+def page_count(path):
+    with pymupdf.open(path) as doc:
+        return doc.page_count
+
+
+def render_page(path, page_index, dpi=PDF_DPI, max_pixels=None):
+    with pymupdf.open(path) as doc:
+        page = doc.load_page(page_index)
+        if max_pixels:
+            # Checked from the page size before anything is rasterized
+            width, height = (round(side * dpi / 72) for side in (page.rect.width, page.rect.height))
+            if width * height > max_pixels:
+                raise ValueError(f'Page is {width}x{height} pixels at {dpi} dpi; '
+                                 f'the limit is {max_pixels // 1_000_000} megapixels')
+        pixmap = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY, alpha=False)
+    gray = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)
+    # Copy so the array does not keep the pixmap alive, and drop any row padding
+    return gray[:, :pixmap.width].copy()
@@ -0,0 +1,315 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from image_headers import image_size
+
+logger = logging.getLogger(__name__)
+
+# Neighbourhood of about one normalized text line, and how much darker than its mean
+# a pixel must be to count as ink
+ADAPTIVE_BLOCK = 31
+ADAPTIVE_C = 15
+
+REDUCED_GRAYSCALE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+]
+
+
+def decode_image(image_bytes, min_long_side=2000, stats=None, max_pixels=None):
+    # Decode straight to grayscale; large JPEGs are DCT-scaled while decoding so the
+    # full-resolution colour image is never allocated
+    start = time.perf_counter()
+    header = image_size(image_bytes)
+    if max_pixels and header and header[1] * header[2] > max_pixels:
+        # Uploads are checked as they stream in; this also covers zip members, batch
+        # workers and TIFFs whose size was past the part of the file the check read
+        raise ValueError(f'Image is {header[1]}x{header[2]} pixels; '
+                         f'the limit is {max_pixels // 1_000_000} megapixels')
+    flags, reduction = cv2.IMREAD_GRAYSCALE, 1
+    if header and header[0] == 'jpeg':
+        long_side = max(header[1], header[2])
+        for factor, reduced_flags in REDUCED_GRAYSCALE_FLAGS:
+            if long_side // factor >= min_long_side:
+                flags, reduction = reduced_flags, factor
+                break
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+    if image is None:
+        return None
+
+    elapsed = time.perf_counter() - start
+    full_color_bytes = header[1] * header[2] * 3 if header else image.size * 3 * reduction * reduction
+    report = {
+        'format': header[0] if header else None,
+        'reduction': reduction,
+        'width': image.shape[1],
+        'height': image.shape[0],
+        'decoded_bytes': image.nbytes,
+        'full_color_bytes': full_color_bytes,
+        'saved_bytes': full_color_bytes - image.nbytes,
+        'seconds': elapsed,
+    }
+    logger.info('decoded %dx%d at 1/%d grayscale in %.1f ms: %.1f MB instead of %.1f MB',
+                image.shape[1], image.shape[0], reduction, elapsed * 1000,
+                image.nbytes / 1e6, full_color_bytes / 1e6)
+    if stats is not None:
+        stats['decode'] = report
+    return image
+
+
+def estimate_text_height(gray, sample_long_side=1000):
+    scale = min(1.0, sample_long_side / float(max(gray.shape[:2])))
+    sample = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    _, ink = cv2.threshold(sample, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    count, _, components, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = components[1:count, cv2.CC_STAT_HEIGHT]
+    widths = components[1:count, cv2.CC_STAT_WIDTH]
+    # Character-shaped components only: not specks, rules, borders or big graphics
+    glyphs = (heights >= 3) & (heights <= sample.shape[0] * 0.05) & (widths <= heights * 3)
+    if glyphs.sum() < 20:
+        return None
+    return float(np.median(heights[glyphs])) / scale
+
+
+def normalize_resolution(gray, target_text_height=30, tolerance=0.2, stats=None, buffers=None):
+    start = time.perf_counter()
+    text_height = estimate_text_height(gray)
+    scale = 1.0
+    if text_height:
+        scale = min(2.0, max(0.25, target_text_height / text_height))
+    if abs(scale - 1.0) > tolerance:
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        size = (int(round(gray.shape[1] * scale)), int(round(gray.shape[0] * scale)))
+        dst = buffers.get('normalized', (size[1], size[0])) if buffers else None
+        resized = cv2.resize(gray, size, dst=dst, interpolation=interpolation)
+    else:
+        scale, resized = 1.0, gray
+
+    if stats is not None:
+        stats['normalize'] = {
+            'text_height': text_height,
+            'scale': scale,
+            'pixels_before': gray.shape[0] * gray.shape[1],
+            'pixels_after': resized.shape[0] * resized.shape[1],
+            'seconds': time.perf_counter() - start,
+        }
+    return resized
+
+
+def binarize(gray, method='otsu', dst=None):
+    if method == 'adaptive':
+        # Threshold against the local mean: copes with uneven lighting that no single level fits
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                     ADAPTIVE_BLOCK, ADAPTIVE_C, dst=dst)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
+    return binary
+
+
+def _profile_sharpness(ys, xs, angles):
+    # Row histogram of the ink sheared by each angle, all in one bincount
+    rows = np.rint(ys + np.tan(np.radians(angles, dtype=np.float32))[:, None] * xs).astype(np.int64)
+    rows -= rows.min()
+    span = int(rows.max()) + 1
+    counts = np.bincount((rows + span * np.arange(len(angles))[:, None]).ravel(),
+                         minlength=span * len(angles)).reshape(len(angles), span)
+    return (counts.astype(np.float64) ** 2).sum(axis=1)
+
+
+def estimate_skew(gray, max_angle=5.0, step=0.25, max_points=10000):
+    # Projection profiles: the angle whose sheared row histogram is sharpest is the one
+    # the text lines run at. Searched at 1 degree, then refined around the best.
+    # Degrees, positive when the lines rise to the right.
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    ys, xs = np.nonzero(ink)
+    if len(xs) < 100:
+        return 0.0
+    stride = max(1, len(xs) // max_points)
+    ys, xs = ys[::stride].astype(np.float32), xs[::stride].astype(np.float32)
+    coarse = np.arange(-max_angle, max_angle + 0.5, 1.0)
+    best = coarse[np.argmax(_profile_sharpness(ys, xs, coarse))]
+    fine = np.arange(best - 1 + step, best + 1, step)
+    return float(fine[np.argmax(_profile_sharpness(ys, xs, fine))])
+
+
+def assess_quality(gray, sample_long_side=800):
+    """Contrast, lighting, sharpness, noise and skew of a page, from a downsampled copy."""
+    # Integer factors take OpenCV's fast path for area averaging
+    factor = int(np.ceil(max(gray.shape[:2]) / float(sample_long_side)))
+    small = cv2.resize(gray, None, fx=1.0 / factor, fy=1.0 / factor, interpolation=cv2.INTER_AREA) \
+        if factor > 1 else gray
+    cdf = np.cumsum(cv2.calcHist([small], [0], None, [256], [0, 256]).ravel())
+    low, high = np.searchsorted(cdf, [0.02 * cdf[-1], 0.98 * cdf[-1]])
+    # Paper brightness per cell with the ink dilated away: uneven lighting shows as spread
+    paper = cv2.dilate(small, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15)))
+    cells = cv2.resize(paper, (8, 8), interpolation=cv2.INTER_AREA)
+    # Noise as what a 3x3 median removes from the paper; sharpness measured after it, so
+    # grain does not pass for crisp edges
+    smooth = cv2.medianBlur(small, 3)
+    residual = cv2.absdiff(small, smooth)
+    level = otsu_level(smooth)
+    return {
+        'contrast': int(high - low),
+        'lighting': int(cells.max()) - int(cells.min()),
+        'sharpness': round(float(cv2.Laplacian(smooth, cv2.CV_32F).var()), 1),
+        'noise': round(float(residual[smooth > level].mean()), 2) if (smooth > level).any() else 0.0,
+        'skew': round(estimate_skew(small), 2),
+    }
+
+
+def triage(quality, limits):
+    """('cheap', []) for a clean page, else ('heavy', [what is wrong with it])."""
+    reasons = []
+    if quality['contrast'] < limits['min_contrast']:
+        reasons.append('contrast')
+    if quality['lighting'] > limits['max_lighting']:
+        reasons.append('lighting')
+    if quality['sharpness'] < limits['min_sharpness']:
+        reasons.append('blur')
+    if quality['noise'] > limits['max_noise']:
+        reasons.append('noise')
+    if abs(quality['skew']) > limits['max_skew']:
+        reasons.append('skew')
+    return ('heavy' if reasons else 'cheap'), reasons
+
+
+def clean_up(gray, quality, reasons, method='otsu', buffers=None):
+    """Heavy chain: only the steps the page's problems call for. Returns (gray, threshold method)."""
+    height, width = gray.shape
+    if 'skew' in reasons:
+        matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), -quality['skew'], 1.0)
+        dst = buffers.get('deskewed', gray.shape) if buffers else None
+        gray = cv2.warpAffine(gray, matrix, (width, height), dst=dst, flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REPLICATE)
+    if 'noise' in reasons:
+        # A median keeps stroke edges; non-local means does better but costs seconds a page
+        gray = cv2.medianBlur(gray, 3)
+    if 'blur' in reasons:
+        # Unsharp mask: restore some edge contrast before thresholding
+        soft = cv2.GaussianBlur(gray, (0, 0), 2)
+        gray = cv2.addWeighted(gray, 1.6, soft, -0.6, 0)
+    if {'lighting', 'contrast', 'blur', 'noise'} & set(reasons):
+        method = 'adaptive'
+    return gray, method
+
+
+def otsu_level(gray):
+    # Otsu's threshold from the page histogram, so strips can share one global level
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel().astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * levels)
+    total, total_mean = weight[-1], mean[-1]
+    background, foreground = weight, total - weight
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mean * background - mean * total) ** 2 / (background * foreground)
+    if np.isnan(between[:-1]).all():
+        # A single grey level (a blank page): put it all on the background side
+        return max(int(np.argmax(hist)) - 1, 0)
+    return int(np.nanargmax(between[:-1]))
+
+
+def strips(height, width, max_bytes, overlap):
+    """(top, bottom, keep_top, keep_bottom) bands of at most max_bytes of 8-bit pixels.
+
+    Neighbouring strips overlap so a line cut by one edge is whole in the next; each
+    strip keeps only the words centred in its own share of the overlap.
+    """
+    rows = max(overlap * 3, max_bytes // max(1, width))
+    bands = []
+    top = 0
+    while True:
+        bottom = min(height, top + rows)
+        keep_top = 0 if top == 0 else top + overlap // 2
+        keep_bottom = height if bottom == height else bottom - overlap // 2
+        bands.append((top, bottom, keep_top, keep_bottom))
+        if bottom == height:
+            return bands
+        top = bottom - overlap
+
+
+def _text_line_boxes(binary):
+    height, width = binary.shape[:2]
+    ink = cv2.bitwise_not(binary)
+
+    # Rulings and page borders would chain every line into one blob
+    horizontal = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(40, width // 15), 1)))
+    vertical = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(40, height // 15))))
+    ink = cv2.subtract(ink, cv2.bitwise_or(horizontal, vertical))
+
+    # Smear characters sideways so each text line becomes one blob
+    smear = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 100), max(3, height // 400)))
+    lines = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, smear)
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_height = max(6, height // 200)
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < min_height or w < min_height:
+            continue
+        # Scanner edges and dashed border fragments hug the page boundary
+        if x <= 2 or y <= 2 or x + w >= width - 2 or y + h >= height - 2:
+            continue
+        # Solid blobs are photos, seals and smudges, not strokes of text
+        if cv2.countNonZero(ink[y:y + h, x:x + w]) > 0.6 * w * h:
+            continue
+        boxes.append((x, y, w, h))
+    if not boxes:
+        return []
+
+    # Logos, emblems and signatures are much taller than a line of text
+    line_height = float(np.median([h for _, _, _, h in boxes]))
+    return [box for box in boxes if box[3] <= 3 * line_height]
+
+
+def _union(a, b):
+    x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+    x1, y1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def find_text_regions(binary, max_regions=8, padding=12, max_coverage=0.75):
+    """Crop boxes (x, y, w, h) around the page's text, or None when cropping would not pay off."""
+    height, width = binary.shape[:2]
+    boxes = sorted(_text_line_boxes(binary), key=lambda box: box[1])
+    if not boxes:
+        return None
+
+    # Anything sharing a row goes in one band, so a subject and its marks stay together
+    bands = [boxes[0]]
+    for box in boxes[1:]:
+        last = bands[-1]
+        if box[1] < last[1] + last[3]:
+            bands[-1] = _union(last, box)
+        else:
+            bands.append(box)
+
+    while len(bands) > max_regions:
+        gaps = [bands[i + 1][1] - (bands[i][1] + bands[i][3]) for i in range(len(bands) - 1)]
+        i = gaps.index(min(gaps))
+        bands[i:i + 2] = [_union(bands[i], bands[i + 1])]
+
+    regions = []
+    for x, y, w, h in bands:
+        x0, y0 = max(0, x - padding), max(0, y - padding)
+        x1, y1 = min(width, x + w + padding), min(height, y + h + padding)
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+
+    coverage = sum(w * h for _, _, w, h in regions) / float(width * height)
+    logger.debug('text regions: %d crops covering %.0f%% of the page', len(regions), coverage * 100)
+    if coverage > max_coverage:
+        return None
+    return regions
+
+
+def make_thumbnail(image, max_side=480, quality=80):
+    scale = min(1.0, max_side / float(max(image.shape[:2])))
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if ok else None
@@ -1,7 +1,10 @@
 #!/usr/bin/env bash
 
 # Install Tesseract and dependencies
-apt-get update && apt-get install -y tesseract-ocr libtesseract-dev
+apt-get update && apt-get install -y tesseract-ocr libtesseract-dev libleptonica-dev pkg-config
 
 # Install Python packages
 pip install -r requirements.txt
+
+# Optional: in-process tesseract workers (app falls back to pytesseract without it)
+pip install tesserocr || echo "tesserocr build failed; OCR will use pytesseract"
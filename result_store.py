@@ -0,0 +1,147 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    page INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    filename TEXT,
+    name TEXT COLLATE NOCASE,
+    index_number TEXT,
+    subjects TEXT NOT NULL,
+    confidence TEXT,
+    timings TEXT,
+    UNIQUE (image_hash, page)
+);
+CREATE INDEX IF NOT EXISTS results_name ON results (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS results_index_number ON results (index_number);
+"""
+
+COLUMNS = ['id', 'image_hash', 'page', 'created_at', 'filename', 'name', 'index_number',
+           'subjects', 'confidence', 'timings']
+JSON_COLUMNS = {'subjects', 'confidence', 'timings'}
+
+
+def _row_to_record(row):
+    record = dict(zip(COLUMNS, row))
+    for column in JSON_COLUMNS:
+        if record[column] is not None:
+            record[column] = json.loads(record[column])
+    return record
+
+
+class ResultStore:
+    """Extraction records in SQLite. Writes are queued and committed in batches by one thread."""
+
+    def __init__(self, path, batch_size=200, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = queue.Queue()
+        self._local = threading.local()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.counters = {'written': 0, 'batches': 0, 'errors': 0}
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        # sqlite3 connections are per thread; WAL lets these read while the writer commits
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def add(self, image_hash, data, filename=None, page=None, timings=None):
+        if 'error' in data:
+            return
+        self._start()
+        self._pending.put((
+            image_hash, page or 0, time.time(), filename, data.get('name'), data.get('index_number'),
+            json.dumps(data.get('subjects', [])),
+            json.dumps(data['confidence']) if data.get('confidence') else None,
+            json.dumps(timings) if timings else None,
+        ))
+
+    def pending(self):
+        return self._pending.qsize()
+
+    def flush(self):
+        self._pending.join()
+
+    def _start(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='result-store-writer', daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            rows = [self._pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self._pending.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    # Re-extracting the same image replaces its record rather than adding another
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO results (image_hash, page, created_at, filename, name, '
+                        'index_number, subjects, confidence, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self.counters['written'] += len(rows)
+                self.counters['batches'] += 1
+            except sqlite3.Error:
+                self.counters['errors'] += len(rows)
+            for _ in rows:
+                self._pending.task_done()
+
+    def find(self, name=None, index_number=None, image_hash=None, limit=50):
+        """Records matching every given filter; `name` matches as a case-insensitive prefix."""
+        clauses, params = [], []
+        if name:
+            # No ESCAPE clause (it would stop SQLite using the index), so drop wildcards instead
+            clauses.append('name LIKE ?')
+            params.append(name.replace('%', '').replace('_', '') + '%')
+        if index_number:
+            clauses.append('index_number = ?')
+            params.append(index_number)
+        if image_hash:
+            clauses.append('image_hash = ?')
+            params.append(image_hash)
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        rows = self._reader().execute(
+            f'SELECT {", ".join(COLUMNS)} FROM results{where} ORDER BY id DESC LIMIT ?', params + [limit])
+        return [_row_to_record(row) for row in rows]
+
+    def iter_all(self, chunk_size=500):
+        # A cursor walked in chunks, so an export never holds the whole table. Its own
+        # connection: a streamed response may be iterated outside the request's thread.
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f'SELECT {", ".join(COLUMNS)} FROM results ORDER BY id')
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield _row_to_record(row)
+        finally:
+            conn.close()
+
+    def stats(self):
+        count, = self._reader().execute('SELECT COUNT(*) FROM results').fetchone()
+        return dict(self.counters, records=count, pending=self.pending(), path=self.path)
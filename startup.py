@@ -0,0 +1,75 @@
+"""Cold-start bookkeeping: deferred imports and a breakdown of where startup time went.
+
+The web process only imports Flask and the small local modules eagerly. The OCR stack
+(OpenCV, numpy, the tesseract bindings, which pull in pandas, and PyMuPDF) is bound to
+LazyModule placeholders and imported on first use or by a background warm-up. Each
+deferred import and warm-up step is timed into STEPS. `python -X importtime -c
+"import app"` gives the per-module detail of the eager part.
+"""
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STARTED = time.perf_counter()
+STEPS = {}
+_lock = threading.RLock()
+
+
+def record(step, seconds):
+    STEPS[step] = seconds
+    logger.info('startup: %s took %.0f ms', step, seconds * 1000)
+
+
+class timed_step:
+    def __init__(self, step):
+        self.step = step
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        record(self.step, time.perf_counter() - self.start)
+
+
+class LazyModule:
+    """Placeholder for a module that is imported, and timed, on first attribute access."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with _lock:
+                module = self.__dict__['_module']
+                if module is None:
+                    with timed_step('import ' + self._name):
+                        module = importlib.import_module(self._name)
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+def load(module):
+    return module._load() if isinstance(module, LazyModule) else module
+
+
+def is_loaded(module):
+    return not isinstance(module, LazyModule) or module.__dict__['_module'] is not None
+
+
+def report():
+    return {
+        'steps_ms': {step: round(seconds * 1000, 1) for step, seconds in
+                     sorted(STEPS.items(), key=lambda item: -item[1])},
+        'uptime_seconds': round(time.perf_counter() - STARTED, 1),
+    }
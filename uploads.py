@@ -0,0 +1,150 @@
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from image_headers import image_size, jpeg_frame_scan, sniff_format
+
+SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 16 * 1024 * 1024))
+MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 80_000_000))
+# Enough for the magic bytes, and for the size field of every format but two: a JPEG's
+# frame header can sit behind any amount of metadata, so its segments are walked by
+# their lengths, and a TIFF's first IFD can be at the end of the file
+SNIFF_BYTES = 16
+HEADER_BYTES = 64 * 1024
+ACCEPTED_FORMATS = {'jpeg', 'png', 'gif', 'bmp', 'webp', 'tiff', 'pdf', 'zip'}
+
+
+def check_pixels(width, height, max_pixels=MAX_PIXELS):
+    if width * height > max_pixels:
+        raise RequestEntityTooLarge(
+            f'Image is {width}x{height} pixels; the limit is {max_pixels // 1_000_000} megapixels')
+
+
+def inspect_header(head, max_pixels=MAX_PIXELS, complete=False):
+    """(format, dimensions) from a file's first bytes, or from all of it with `complete`.
+
+    dimensions is None while more bytes are needed, and () for PDFs, zips and TIFFs
+    whose first IFD lies past HEADER_BYTES (preprocess.decode_image checks those).
+    Raises UnsupportedMediaType or RequestEntityTooLarge for a file that is refused,
+    including an image whose size is not where its format puts it.
+    """
+    if len(head) < SNIFF_BYTES:
+        if complete:
+            raise UnsupportedMediaType('Unsupported file type; upload an image, PDF or zip file')
+        return None, None
+    fmt = sniff_format(head)
+    if fmt not in ACCEPTED_FORMATS:
+        raise UnsupportedMediaType('Unsupported file type; upload an image, PDF or zip file')
+    if fmt in ('pdf', 'zip'):
+        return fmt, ()
+    header = image_size(head)
+    if header:
+        check_pixels(header[1], header[2], max_pixels)
+        return fmt, header[1:]
+    if complete or (len(head) >= HEADER_BYTES and fmt not in ('jpeg', 'tiff')):
+        raise UnsupportedMediaType('Could not read the image size from its header')
+    if fmt == 'tiff' and len(head) >= HEADER_BYTES:
+        return fmt, ()
+    return fmt, None
+
+
+class ValidatingSpool(tempfile.SpooledTemporaryFile):
+    """Upload buffer that checks the file while werkzeug streams it in.
+
+    The type is sniffed from the first bytes and the pixel count read from the image
+    header, so a bad upload is rejected on its first chunk, before the rest of the body
+    is stored or anything is decoded. The SHA-256 is computed along the way.
+    With `defer_errors` the refusal is kept as `rejection` instead of raised, and the
+    rest of the file is discarded, so one bad file need not fail a multi-file request.
+    """
+
+    def __init__(self, max_size=SPOOL_THRESHOLD, max_pixels=MAX_PIXELS, defer_errors=False):
+        super().__init__(max_size=max_size, mode='rb+')
+        self.max_pixels = max_pixels
+        self.defer_errors = defer_errors
+        self.format = None
+        self.dimensions = None
+        self.rejection = None
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self._seen = 0
+        # JPEGs past HEADER_BYTES: file offset of the next segment marker, and the bytes
+        # from there that have arrived so far
+        self._jpeg_next = None
+        self._jpeg_window = b''
+
+    def write(self, data):
+        if self.rejection is not None:
+            return len(data)
+        self._digest.update(data)
+        try:
+            self._inspect(data)
+        except (RequestEntityTooLarge, UnsupportedMediaType) as e:
+            if not self.defer_errors:
+                raise
+            self.rejection = e
+            return len(data)
+        return super().write(data)
+
+    def _inspect(self, data):
+        start = self._seen
+        self._seen += len(data)
+        if self.dimensions is not None:
+            return
+        if self._jpeg_next is not None:
+            self._walk_jpeg(data, start)
+            return
+        taken = HEADER_BYTES - len(self._head)
+        self._head += bytes(data[:taken])
+        self.format, self.dimensions = inspect_header(self._head, self.max_pixels)
+        if self.format == 'jpeg' and self.dimensions is None and len(self._head) >= HEADER_BYTES:
+            _, offset = jpeg_frame_scan(self._head)
+            if offset is None:
+                raise UnsupportedMediaType('Could not read the image size from its header')
+            self._jpeg_next, self._jpeg_window = offset, self._head[offset:]
+            self._walk_jpeg(data[taken:], HEADER_BYTES)
+
+    def _walk_jpeg(self, data, start):
+        # `data` begins at file offset `start`; the window always runs from _jpeg_next up to it
+        if self._jpeg_next >= start + len(data):
+            return
+        self._jpeg_window += bytes(data[max(0, self._jpeg_next - start):])
+        size, offset = jpeg_frame_scan(self._jpeg_window, 0)
+        if offset is None:
+            raise UnsupportedMediaType('Could not read the image size from its header')
+        if size:
+            check_pixels(size[0], size[1], self.max_pixels)
+            self.dimensions, self._jpeg_window = size, b''
+            return
+        self._jpeg_next += offset
+        self._jpeg_window = self._jpeg_window[offset:]
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+
+class SpoolingRequest(Request):
+    # Werkzeug spools anything over 500KB to disk; keep uploads in memory up to our own limit.
+    # On endpoints in the PER_FILE_UPLOAD_ENDPOINTS config, a refused file becomes its own error entry.
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        per_file = self.endpoint in current_app.config.get('PER_FILE_UPLOAD_ENDPOINTS', ())
+        return ValidatingSpool(defer_errors=per_file)
+
+
+@contextmanager
+def upload_buffer(stream, spool_threshold=SPOOL_THRESHOLD):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size <= spool_threshold:
+        yield stream.read()
+        return
+    # Oversized uploads already live in an anonymous temp file; map it instead of copying
+    with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        yield view